@@ -0,0 +1,101 @@
+"""
+Mux time of each audio policy on a synthetic hour-long lecture.
+
+The fixture mirrors what an HLS download leaves behind: a video-only track and a
+separate AAC audio track. Both are muxed with `EchoCloudVideo.combine_audio_video`
+once per policy; "copy" is the default, the others transcode the audio. CPU time is
+the user + system time of the ffmpeg child processes. Needs ffmpeg on the PATH.
+
+    python -m benchmarks.bench_audio_policy [--seconds 3600] [--policies copy ac3]
+"""
+
+import argparse
+import json
+import os
+import resource
+import shutil
+import subprocess
+import tempfile
+import time
+
+from echo360.videos import EchoCloudVideo
+
+
+def ffmpeg(*args):
+    subprocess.run(["ffmpeg", "-loglevel", "error", "-y"] + list(args), check=True)
+
+
+def make_fixture(directory, seconds, size):
+    video = os.path.join(directory, "lecture_video.mp4")
+    audio = os.path.join(directory, "lecture_audio.m4a")
+    # the video is only there to be copied, keep it cheap to generate
+    ffmpeg(
+        "-f",
+        "lavfi",
+        "-i",
+        "testsrc2=size={}:rate=5:duration={}".format(size, seconds),
+        "-c:v",
+        "libx264",
+        "-preset",
+        "ultrafast",
+        video,
+    )
+    ffmpeg(
+        "-f",
+        "lavfi",
+        "-i",
+        "sine=frequency=440:sample_rate=48000:duration={}".format(seconds),
+        "-ac",
+        "2",
+        "-c:a",
+        "aac",
+        "-b:a",
+        "128k",
+        audio,
+    )
+    return video, audio
+
+
+def children_cpu():
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--seconds", type=int, default=3600)
+    parser.add_argument("--size", default="320x180")
+    parser.add_argument("--policies", nargs="+", default=["copy", "ac3"])
+    parser.add_argument("--repeat", type=int, default=1)
+    args = parser.parse_args()
+    if shutil.which("ffmpeg") is None:
+        parser.error("ffmpeg not found on PATH")
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        video, audio = make_fixture(tmp, args.seconds, args.size)
+        for policy in args.policies:
+            output = os.path.join(tmp, "lecture-{}.mp4".format(policy))
+            best_wall = best_cpu = float("inf")
+            for _ in range(args.repeat):
+                cpu = children_cpu()
+                wall = time.perf_counter()
+                EchoCloudVideo.combine_audio_video(
+                    audio, video, output, audio_codec=policy
+                )
+                best_wall = min(best_wall, time.perf_counter() - wall)
+                best_cpu = min(best_cpu, children_cpu() - cpu)
+            results.append(
+                dict(
+                    policy=policy,
+                    lecture_s=args.seconds,
+                    wall_s=round(best_wall, 3),
+                    cpu_s=round(best_cpu, 3),
+                    output_mb=round(os.path.getsize(output) / 1024 / 1024, 1),
+                )
+            )
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+"""
+End-to-end download throughput against the local stand-in server.
+
+Starts `benchmarks.standin_server` with the given content and fault options, then
+downloads its HLS video playlist with `hls_downloader.Downloader.run` for each pool
+size and its mp4 with `mp4_downloader.download_mp4` for each connection count. Each
+case runs in a fresh process, so peak RSS and CPU time belong to that case alone.
+Request latencies (p50/p99) come from the per-request metrics hook that both paths
+feed: every segment request for HLS, every range request for the mp4, measured from
+when the request got its slot to the end of its body.
+
+    python -m benchmarks.bench_download [--pool-sizes 10 50] [--mp4-connections 1 8]
+        [--segments 2000] [--latency-ms 20] [--error-rate 0.01] [--throttle-rate 0.01]
+"""
+
+from gevent import monkey
+
+monkey.patch_all()
+
+import argparse
+import contextlib
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from echo360.hls_downloader import Downloader
+from echo360.mp4_downloader import download_mp4
+from echo360.retry import RetryPolicy
+from echo360.scheduler import RequestLimiter, TransferStats
+from echo360.sessions import get_session, get_session_registry
+
+from .standin_server import SERVER_OPTIONS, add_arguments, server_argv
+
+
+class RequestRecorder:
+    """Stands in for `metrics.LectureMetrics`, keeping every request's latency."""
+
+    def __init__(self):
+        self.latencies = []
+        self.failures = 0
+
+    def record_request(
+        self, url, latency, nbytes=0, status=None, ttfb=None, error=False
+    ):
+        if error or status is None or status >= 400:
+            self.failures += 1
+        else:
+            self.latencies.append(latency)
+
+    def record_segment(self, url, attempts, ok=True):
+        pass
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+
+def run_case(path, base_url, concurrency):
+    """Download once in this process and return the measurements."""
+    get_session_registry().configure(pool_maxsize=max(concurrency, 10))
+    limiter = RequestLimiter(concurrency)
+    recorder = RequestRecorder()
+    stats = TransferStats()
+    # the stand-in answers 429 with Retry-After: 0, keep the backoff short as well
+    retry_policy = RetryPolicy(base_delay=0.05, budget=10**9)
+    with tempfile.TemporaryDirectory() as tmp, open(os.devnull, "w") as devnull:
+        cpu = time.process_time()
+        wall = time.perf_counter()
+        with contextlib.redirect_stdout(devnull):
+            if path == "hls":
+                Downloader(
+                    concurrency,
+                    resume=False,
+                    limiter=limiter,
+                    stats=stats,
+                    retry_policy=retry_policy,
+                    metrics=recorder,
+                ).run(base_url + "/video.m3u8", tmp, output_name="video")
+            else:
+                url = base_url + "/lecture.mp4"
+                download_mp4(
+                    get_session(url),
+                    url,
+                    os.path.join(tmp, "lecture.mp4"),
+                    resume=False,
+                    stats=stats,
+                    connections=concurrency,
+                    limiter=limiter,
+                    retry_policy=retry_policy,
+                    metrics=recorder,
+                )
+        wall = time.perf_counter() - wall
+        cpu = time.process_time() - cpu
+    p50 = percentile(recorder.latencies, 0.5)
+    p99 = percentile(recorder.latencies, 0.99)
+    return dict(
+        path=path,
+        concurrency=concurrency,
+        mb=round(stats.bytes / 1024 / 1024, 1),
+        wall_s=round(wall, 3),
+        mb_per_s=round(stats.bytes / 1024 / 1024 / wall, 1),
+        p50_ms=None if p50 is None else round(p50 * 1000, 2),
+        p99_ms=None if p99 is None else round(p99 * 1000, 2),
+        failed_requests=recorder.failures,
+        cpu_s=round(cpu, 3),
+        # kilobytes on Linux
+        peak_rss_mb=round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    )
+
+
+def start_server(args):
+    server = subprocess.Popen(
+        [sys.executable, "-m", "benchmarks.standin_server"] + server_argv(args),
+        stdout=subprocess.PIPE,
+        universal_newlines=True,
+    )
+    line = server.stdout.readline()
+    if not line.startswith("PORT "):
+        server.kill()
+        raise RuntimeError("Stand-in server did not start: {!r}".format(line))
+    return server, "http://127.0.0.1:{}".format(int(line.split()[1]))
+
+
+def run_in_child(path, base_url, concurrency):
+    output = subprocess.run(
+        [
+            sys.executable,
+            "-m",
+            "benchmarks.bench_download",
+            "--case",
+            path,
+            "--base-url",
+            base_url,
+            "--concurrency",
+            str(concurrency),
+        ],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+        universal_newlines=True,
+        check=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    add_arguments(parser)
+    parser.add_argument("--pool-sizes", type=int, nargs="+", default=[10, 50])
+    parser.add_argument("--mp4-connections", type=int, nargs="+", default=[1, 8])
+    parser.add_argument("--paths", nargs="+", choices=("hls", "mp4"), default=None)
+    # internal: run a single case in this process
+    parser.add_argument("--case", choices=("hls", "mp4"), help=argparse.SUPPRESS)
+    parser.add_argument("--base-url", help=argparse.SUPPRESS)
+    parser.add_argument("--concurrency", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.case is not None:
+        print(json.dumps(run_case(args.case, args.base_url, args.concurrency)))
+        return
+
+    paths = args.paths or ["hls", "mp4"]
+    cases = [("hls", n) for n in args.pool_sizes if "hls" in paths]
+    cases += [("mp4", n) for n in args.mp4_connections if "mp4" in paths]
+    server, base_url = start_server(args)
+    try:
+        results = [run_in_child(path, base_url, n) for path, n in cases]
+    finally:
+        server.kill()
+        server.wait()
+    server_options = {option: getattr(args, option) for option in SERVER_OPTIONS}
+    print(json.dumps(dict(server=server_options, results=results), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+Wall and CPU time of each `--feed-mode` on a synthetic dual-feed lecture.
+
+Two feeds (camera and screen stand-ins) are generated with ffmpeg's test sources,
+then combined the way `EchoCloudVideo.combine_feeds` does for every mode. CPU time
+is the user + system time of the ffmpeg child processes. Needs ffmpeg on the PATH.
+
+    python -m benchmarks.bench_feed_modes [--seconds 120] [--size 1280x720]
+"""
+
+import argparse
+import json
+import os
+import resource
+import shutil
+import subprocess
+import tempfile
+import time
+
+from echo360.videos import FEED_MODES, EchoCloudVideo
+
+
+def make_feed(path, seconds, size, source):
+    subprocess.run(
+        [
+            "ffmpeg",
+            "-loglevel",
+            "error",
+            "-f",
+            "lavfi",
+            "-i",
+            "{}=size={}:rate=25:duration={}".format(source, size, seconds),
+            "-f",
+            "lavfi",
+            "-i",
+            "sine=frequency=440:duration={}".format(seconds),
+            "-c:v",
+            "libx264",
+            "-preset",
+            "ultrafast",
+            "-c:a",
+            "aac",
+            "-shortest",
+            path,
+        ],
+        check=True,
+    )
+
+
+def children_cpu():
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--seconds", type=int, default=120)
+    parser.add_argument("--size", default="1280x720")
+    parser.add_argument("--modes", nargs="+", default=list(FEED_MODES))
+    args = parser.parse_args()
+    if shutil.which("ffmpeg") is None:
+        parser.error("ffmpeg not found on PATH")
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        sources = [os.path.join(tmp, "source{}.mp4".format(i)) for i in (1, 2)]
+        make_feed(sources[0], args.seconds, args.size, "testsrc2")
+        make_feed(sources[1], args.seconds, args.size, "smptebars")
+        for mode in args.modes:
+            workdir = os.path.join(tmp, mode)
+            os.mkdir(workdir)
+            # combine_feeds consumes its inputs
+            feeds = []
+            for i, source in enumerate(sources):
+                feeds.append(os.path.join(workdir, "lecture{}.mp4".format(i + 1)))
+                shutil.copy(source, feeds[-1])
+            cpu = children_cpu()
+            wall = time.perf_counter()
+            outputs = EchoCloudVideo.combine_feeds(
+                feeds, os.path.join(workdir, "lecture"), mode
+            )
+            wall = time.perf_counter() - wall
+            cpu = children_cpu() - cpu
+            results.append(
+                dict(
+                    mode=mode,
+                    wall_s=round(wall, 3),
+                    cpu_s=round(cpu, 3),
+                    cpu_s_per_lecture_minute=round(cpu * 60 / args.seconds, 3),
+                    output_mb=round(
+                        sum(
+                            os.path.getsize(os.path.join(workdir, name))
+                            for name in os.listdir(workdir)
+                        )
+                        / 1024
+                        / 1024,
+                        1,
+                    ),
+                    outputs=[os.path.basename(path) for path in outputs],
+                )
+            )
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
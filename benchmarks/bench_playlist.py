@@ -0,0 +1,109 @@
+"""
+Compare `echo360.playlist.parse_playlist` with the code it replaced.
+
+The legacy path is what `Downloader.run` and `EchoCloudVideo.download_single` used to
+do: `NaiveM3U8Parser` on the master playlist, then splitting the media playlist on
+newlines and keeping every line that is not a tag.
+
+    python -m benchmarks.bench_playlist [--segments 10000 50000] [--repeat 20]
+"""
+
+import argparse
+import json
+import time
+
+from echo360.playlist import parse_playlist
+
+from .naive_m3u8_parser import NaiveM3U8Parser
+
+BASE_URL = "https://content.echo360.org/0000/1111/1/s1q1.m3u8"
+
+
+def master_playlist():
+    return "\n".join(
+        [
+            "#EXTM3U",
+            "#EXT-X-VERSION:7",
+            "#EXT-X-INDEPENDENT-SEGMENTS",
+            '#EXT-X-MEDIA:TYPE=AUDIO,GROUP-ID="q0",NAME="Default",DEFAULT=YES,'
+            'AUTOSELECT=YES,URI="s0q0.m3u8"',
+            '#EXT-X-MEDIA:TYPE=AUDIO,GROUP-ID="q1",NAME="Default",DEFAULT=YES,'
+            'AUTOSELECT=YES,URI="s0q1.m3u8"',
+            "#EXT-X-STREAM-INF:BANDWIDTH=55528,RESOLUTION=640x360,PROGRAM-ID=1,"
+            'AUDIO="q0",CODECS="avc1.640029,mp4a.40.2",FRAME-RATE=25.0',
+            "s1q0.m3u8",
+            "#EXT-X-STREAM-INF:BANDWIDTH=220997,RESOLUTION=1920x1080,PROGRAM-ID=1,"
+            'AUDIO="q1",CODECS="avc1.640029,mp4a.40.2",FRAME-RATE=25.0',
+            "s1q1.m3u8",
+        ]
+    )
+
+
+def media_playlist(segments):
+    lines = [
+        "#EXTM3U",
+        "#EXT-X-VERSION:7",
+        "#EXT-X-TARGETDURATION:4",
+        "#EXT-X-MEDIA-SEQUENCE:0",
+        "#EXT-X-PLAYLIST-TYPE:VOD",
+        '#EXT-X-MAP:URI="s1q1.mp4",BYTERANGE="1200@0"',
+    ]
+    for i in range(segments):
+        lines.append("#EXTINF:4.000,")
+        lines.append("s1q1-{}.m4s".format(i))
+    lines.append("#EXT-X-ENDLIST")
+    return "\n".join(lines)
+
+
+def legacy(master, media):
+    parser = NaiveM3U8Parser(master.split("\n"))
+    parser.parse()
+    parser.get_video_and_audio()
+    base = BASE_URL[: BASE_URL.rfind("/") + 1]
+    ts_list = [
+        base + n.strip().lstrip("/")
+        for n in media.split("\n")
+        if n and not n.startswith("#")
+    ]
+    return list(zip(ts_list, range(len(ts_list))))
+
+
+def current(master, media):
+    parse_playlist(master, base_url=BASE_URL).video_and_audio()
+    return parse_playlist(media, base_url=BASE_URL).segments
+
+
+def measure(fn, repeat, *args):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--segments", type=int, nargs="+", default=[10000, 50000])
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    master = master_playlist()
+    results = []
+    for segments in args.segments:
+        media = media_playlist(segments)
+        legacy_s = measure(legacy, args.repeat, master, media)
+        current_s = measure(current, args.repeat, master, media)
+        results.append(
+            dict(
+                segments=segments,
+                legacy_ms=round(legacy_s * 1000, 3),
+                playlist_ms=round(current_s * 1000, 3),
+                playlist_us_per_segment=round(current_s * 1e6 / segments, 3),
+            )
+        )
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+CPU cost of writing a streamed response body to disk.
+
+The legacy path is what the downloaders used to do: `iter_content(1024)` with a
+progress bar update per chunk. The current path is `echo360.streaming.stream_to_file`
+with its default buffer and batched progress. Bodies come from memory so only the
+client side work is measured.
+
+    python -m benchmarks.bench_streaming [--mb 256] [--chunk-kb 64 1024 4096]
+"""
+
+import argparse
+import io
+import json
+import os
+import tempfile
+import time
+
+import requests
+import tqdm
+from urllib3.response import HTTPResponse
+
+from echo360.streaming import stream_to_file
+
+
+def make_response(body):
+    r = requests.Response()
+    r.status_code = 200
+    r.raw = HTTPResponse(
+        body=io.BytesIO(body), preload_content=False, decode_content=False
+    )
+    return r
+
+
+def legacy(response, f, total):
+    with tqdm.tqdm(total=total, unit="iB", unit_scale=True, disable=None) as pbar:
+        for data in response.iter_content(1024):
+            pbar.update(len(data))
+            f.write(data)
+
+
+def current(response, f, total, chunk_size):
+    with tqdm.tqdm(total=total, unit="iB", unit_scale=True, disable=None) as pbar:
+        stream_to_file(response, f, chunk_size=chunk_size, on_progress=pbar.update)
+
+
+def measure(fn, body, path, *args):
+    with open(path, "wb") as f:
+        response = make_response(body)
+        start = time.process_time()
+        wall = time.perf_counter()
+        fn(response, f, len(body), *args)
+        return time.process_time() - start, time.perf_counter() - wall
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--mb", type=int, default=256)
+    parser.add_argument("--chunk-kb", type=int, nargs="+", default=[64, 1024, 4096])
+    args = parser.parse_args()
+
+    body = os.urandom(args.mb * 1024 * 1024)
+    gb = len(body) / 1024**3
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "body.bin")
+        cpu, wall = measure(legacy, body, path)
+        results.append(
+            dict(
+                path="iter_content(1024)",
+                cpu_s_per_gb=round(cpu / gb, 3),
+                mb_per_s=round(args.mb / wall, 1),
+            )
+        )
+        for chunk_kb in args.chunk_kb:
+            cpu, wall = measure(current, body, path, chunk_kb * 1024)
+            results.append(
+                dict(
+                    path="stream_to_file({} KB)".format(chunk_kb),
+                    cpu_s_per_gb=round(cpu / gb, 3),
+                    mb_per_s=round(args.mb / wall, 1),
+                )
+            )
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
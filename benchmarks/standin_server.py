@@ -0,0 +1,283 @@
+"""
+A local stand-in for the echo360 content servers.
+
+Serves synthetic HLS playlists and segments plus a range-capable mp4, with optional
+latency and injected failures, so the downloaders can be measured without touching
+the real CDN. Run it on its own; it prints `PORT <n>` once it listens.
+
+    python -m benchmarks.standin_server [--segments 2000] [--latency-ms 20]
+        [--error-rate 0.01] [--throttle-rate 0.01]
+
+Routes:
+    /master.m3u8              master playlist, video variant plus an audio rendition
+    /video.m3u8, /audio.m3u8  media playlists of `--segments` segments
+    /video/<i>.ts             `--segment-kb` KB per segment (audio: `--audio-kb`)
+    /lecture.mp4              `--mp4-mb` MB, honours Range and HEAD
+
+Latency and failures only apply to segments and the mp4, a playlist always loads.
+Errors are 503s, throttling is a 429 with `Retry-After: 0`.
+"""
+
+import argparse
+import os
+import random
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+_SEGMENT = re.compile(r"^/(video|audio)/(\d+)\.ts$")
+_RANGE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+class StandInConfig:
+    def __init__(
+        self,
+        segments=2000,
+        segment_kb=256,
+        audio_kb=16,
+        segment_seconds=4.0,
+        mp4_mb=64,
+        latency_ms=0.0,
+        jitter=0.5,
+        error_rate=0.0,
+        throttle_rate=0.0,
+        seed=0,
+    ):
+        self.segments = segments
+        self.segment_size = segment_kb * 1024
+        self.audio_size = audio_kb * 1024
+        self.segment_seconds = segment_seconds
+        self.mp4_size = mp4_mb * 1024 * 1024
+        self.latency = latency_ms / 1000
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        # every body is a slice of this, generating bytes per request would dominate
+        self.blob = os.urandom(max(self.segment_size, self.audio_size, 1024 * 1024))
+
+    def draw(self):
+        """Return `(delay, status)` for one media request; status None means serve."""
+        with self._lock:
+            spread = self._random.uniform(-self.jitter, self.jitter)
+            roll = self._random.random()
+        status = None
+        if roll < self.error_rate:
+            status = 503
+        elif roll < self.error_rate + self.throttle_rate:
+            status = 429
+        return max(self.latency * (1 + spread), 0.0), status
+
+    def master_playlist(self):
+        return "\n".join(
+            [
+                "#EXTM3U",
+                "#EXT-X-VERSION:3",
+                '#EXT-X-MEDIA:TYPE=AUDIO,GROUP-ID="a",NAME="Default",DEFAULT=YES,'
+                'URI="audio.m3u8"',
+                '#EXT-X-STREAM-INF:BANDWIDTH=2000000,RESOLUTION=1280x720,AUDIO="a",'
+                'CODECS="avc1.640029,mp4a.40.2"',
+                "video.m3u8",
+                "",
+            ]
+        )
+
+    def media_playlist(self, track):
+        lines = [
+            "#EXTM3U",
+            "#EXT-X-VERSION:3",
+            "#EXT-X-TARGETDURATION:{}".format(int(self.segment_seconds + 0.999)),
+            "#EXT-X-MEDIA-SEQUENCE:0",
+            "#EXT-X-PLAYLIST-TYPE:VOD",
+        ]
+        for i in range(self.segments):
+            lines.append("#EXTINF:{:.3f},".format(self.segment_seconds))
+            lines.append("{}/{}.ts".format(track, i))
+        lines.append("#EXT-X-ENDLIST")
+        return "\n".join(lines) + "\n"
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    # keep-alive, the downloaders rely on connection reuse
+    protocol_version = "HTTP/1.1"
+    # headers and body go out as separate writes, with Nagle on the body would wait
+    # for the client's delayed ACK of the headers
+    disable_nagle_algorithm = True
+
+    @property
+    def config(self):
+        return self.server.config
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_HEAD(self):
+        self.do_GET(head=True)
+
+    def do_GET(self, head=False):
+        path = self.path.split("?", 1)[0]
+        if path == "/master.m3u8":
+            return self._send_text(self.config.master_playlist(), head)
+        if path in ("/video.m3u8", "/audio.m3u8"):
+            return self._send_text(self.config.media_playlist(path[1:6]), head)
+        match = _SEGMENT.match(path)
+        if match and int(match.group(2)) < self.config.segments:
+            size = (
+                self.config.segment_size
+                if match.group(1) == "video"
+                else self.config.audio_size
+            )
+            if self._inject_fault():
+                return
+            return self._send_body(size, 0, size, "video/mp2t", head)
+        if path == "/lecture.mp4":
+            if self._inject_fault():
+                return
+            return self._send_mp4(head)
+        self._send_status(404)
+
+    def _inject_fault(self):
+        delay, status = self.config.draw()
+        if delay:
+            time.sleep(delay)
+        if status is None:
+            return False
+        headers = {"Retry-After": "0"} if status == 429 else {}
+        self._send_status(status, headers)
+        return True
+
+    def _send_mp4(self, head):
+        total = self.config.mp4_size
+        match = _RANGE.match(self.headers.get("Range", ""))
+        if match is None:
+            return self._send_body(total, 0, total, "video/mp4", head)
+        first, last = match.groups()
+        if first:
+            start = int(first)
+            end = min(int(last), total - 1) if last else total - 1
+        else:
+            # a suffix range, the last N bytes
+            start, end = max(total - int(last or 0), 0), total - 1
+        if start >= total or start > end:
+            self._send_status(416, {"Content-Range": "bytes */{}".format(total)})
+            return
+        headers = {"Content-Range": "bytes {}-{}/{}".format(start, end, total)}
+        self._send_body(total, start, end + 1, "video/mp4", head, 206, headers)
+
+    def _send_text(self, text, head):
+        body = text.encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/vnd.apple.mpegurl")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if not head:
+            self.wfile.write(body)
+
+    def _send_body(self, total, start, end, content_type, head, status=200, headers=()):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(end - start))
+        self.send_header("Accept-Ranges", "bytes")
+        for name, value in dict(headers).items():
+            self.send_header(name, value)
+        self.end_headers()
+        if head:
+            return
+        blob = memoryview(self.config.blob)
+        offset = start
+        while offset < end:
+            # the content is synthetic, repeat the blob as often as needed
+            piece = offset % len(blob)
+            chunk = blob[piece : piece + min(end - offset, len(blob) - piece)]
+            self.wfile.write(chunk)
+            offset += len(chunk)
+
+    def _send_status(self, status, headers=()):
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        for name, value in dict(headers).items():
+            self.send_header(name, value)
+        self.end_headers()
+
+
+class StandInServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # the default backlog of 5 overflows with a large client pool, and the clients
+    # would then sit out SYN retransmits that have nothing to do with the downloaders
+    request_queue_size = 1024
+
+    def __init__(self, config, host="127.0.0.1", port=0):
+        self.config = config
+        super(StandInServer, self).__init__((host, port), StandInHandler)
+
+    @property
+    def url(self):
+        return "http://{}:{}".format(*self.server_address)
+
+
+def add_arguments(parser):
+    """The server options, shared with the benchmarks that start the server."""
+    parser.add_argument("--segments", type=int, default=2000)
+    parser.add_argument("--segment-kb", type=int, default=256)
+    parser.add_argument("--audio-kb", type=int, default=16)
+    parser.add_argument("--mp4-mb", type=int, default=64)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--jitter", type=float, default=0.5)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+
+
+SERVER_OPTIONS = (
+    "segments",
+    "segment_kb",
+    "audio_kb",
+    "mp4_mb",
+    "latency_ms",
+    "jitter",
+    "error_rate",
+    "throttle_rate",
+    "seed",
+)
+
+
+def server_argv(args):
+    """Command line options that recreate the server configured by `args`."""
+    argv = []
+    for option in SERVER_OPTIONS:
+        argv += ["--" + option.replace("_", "-"), str(getattr(args, option))]
+    return argv
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    add_arguments(parser)
+    parser.add_argument("--port", type=int, default=0)
+    args = parser.parse_args()
+    config = StandInConfig(
+        segments=args.segments,
+        segment_kb=args.segment_kb,
+        audio_kb=args.audio_kb,
+        mp4_mb=args.mp4_mb,
+        latency_ms=args.latency_ms,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        throttle_rate=args.throttle_rate,
+        seed=args.seed,
+    )
+    server = StandInServer(config, port=args.port)
+    print("PORT {}".format(server.server_address[1]))
+    sys.stdout.flush()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""
+Browserless access to the echo360 JSON endpoints.
+
+Once the user has logged in through the browser, its cookies are exported into the
+shared `SessionRegistry` and every metadata request below goes over plain HTTP. A
+response that looks like a login wall raises `EchoApiAuthError`, so callers can fall
+back to driving the browser for that one request.
+"""
+
+import logging
+import re
+
+from .echo_exceptions import EchoApiAuthError
+from .sessions import get_session_registry
+
+_LOGGER = logging.getLogger(__name__)
+
+_AUTH_STATUSES = {401, 403}
+
+
+def find_media_urls(obj, suffix):
+    """Return every `https://...<suffix>` url found anywhere in a JSON document."""
+    pattern = re.compile(r"https://[^,\"\s]*?[.]{}(?:\?[^,\"\s]*)?$".format(suffix))
+    found = []
+    stack = [obj]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, dict):
+            stack.extend(item.values())
+        elif isinstance(item, list):
+            stack.extend(item)
+        elif isinstance(item, str) and pattern.match(item):
+            found.append(item)
+    return sorted(set(found))
+
+
+class EchoApiClient:
+    """
+    Fetch course and lecture metadata with `requests` instead of Selenium.
+
+    The endpoint paths are class attributes so a deployment that moved them can be
+    handled by subclassing.
+
+    Args:
+        hostname: scheme and host of the echo360 instance, e.g. `https://echo360.org`
+        registry: the `SessionRegistry` to take sessions (and cookies) from
+    """
+
+    SECTION_DATA_PATH = "/ess/client/api/sections/{uuid}/section-data.json"
+    SYLLABUS_PATH = "/section/{uuid}/syllabus"
+    LESSON_MEDIA_PATH = "/api/ui/echoplayer/lessons/{lesson_id}/medias"
+
+    def __init__(self, hostname, registry=None):
+        self.hostname = hostname.rstrip("/")
+        self.registry = registry or get_session_registry()
+
+    def export_cookies(self, driver):
+        """Copy the logged-in browser cookies into the shared sessions."""
+        self.registry.load_cookies(driver.get_cookies())
+
+    def section_data(self, uuid, page_size=100, page_index=1):
+        return self.get_json(
+            self.SECTION_DATA_PATH.format(uuid=uuid),
+            params=(
+                dict(pageSize=page_size, pageIndex=page_index)
+                if page_index > 1
+                else dict(pageSize=page_size)
+            ),
+        )
+
+    def syllabus(self, uuid):
+        return self.get_json(self.SYLLABUS_PATH.format(uuid=uuid))
+
+    def lesson_media(self, lesson_id):
+        return self.get_json(self.LESSON_MEDIA_PATH.format(lesson_id=lesson_id))
+
+    def get_json(self, path, params=None):
+        """
+        GET `path` on the host and decode the JSON body.
+
+        Raises:
+            EchoApiAuthError: when the cookies were rejected or the request ended up
+                on a login page
+            requests.HTTPError: for any other unsuccessful response
+        """
+        url = self.hostname + path
+        r = self.registry.get(url).get(url, params=params, timeout=30)
+        _LOGGER.debug("GET %s -> %s", r.url, r.status_code)
+        if r.status_code in _AUTH_STATUSES:
+            raise EchoApiAuthError("HTTP {} for {}".format(r.status_code, url))
+        r.raise_for_status()
+        try:
+            return r.json()
+        except ValueError:
+            # an expired session is answered with the html login form, not a 401
+            if "html" in r.headers.get("content-type", "") or "login" in r.url:
+                raise EchoApiAuthError("Login page returned for {}".format(url))
+            raise
+
+    def page_media_urls(self, page_url, suffixes=("m3u8", "mp4")):
+        """
+        Look for media urls in the raw html of a lecture page.
+
+        Only works when the page embeds them server side; an empty list means the
+        browser is needed to render the player.
+        """
+        r = self.registry.get(page_url).get(page_url, timeout=30)
+        if r.status_code in _AUTH_STATUSES or "login" in r.url:
+            raise EchoApiAuthError("HTTP {} for {}".format(r.status_code, page_url))
+        r.raise_for_status()
+        pattern = "https://[^,\"'\\s<>]*?[.](?:{})".format("|".join(suffixes))
+        # the player config escapes slashes inside inline javascript
+        return sorted(set(re.findall(pattern, r.text.replace("\\/", "/"))))
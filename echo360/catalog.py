@@ -0,0 +1,139 @@
+import hashlib
+import json
+import logging
+import os
+import time
+from urllib.parse import urlsplit
+
+_LOGGER = logging.getLogger(__name__)
+
+DEFAULT_CACHE_DIR = os.path.join(
+    os.environ.get("XDG_CACHE_HOME", os.path.join(os.path.expanduser("~"), ".cache")),
+    "echo360",
+)
+DEFAULT_TTL = 6 * 3600
+
+
+def fingerprint(lesson_json):
+    """Stable digest of a lesson's JSON; any change upstream changes it."""
+    encoded = json.dumps(lesson_json, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha1(encoded.encode("utf-8")).hexdigest()
+
+
+class CourseCatalog:
+    """
+    On-disk cache of one course section: its raw JSON and resolved media urls.
+
+    The course JSON is reused for `ttl` seconds. Media urls are kept per lesson id
+    together with the fingerprint of the lesson JSON they were resolved from, so after
+    the course JSON is fetched again only new or changed lessons are resolved again.
+    A media url is also only trusted for `ttl` seconds after it was resolved, and
+    lessons without one are not cached at all, e.g. a recording still being
+    processed. The cache lives in `<cache_dir>/<host>/<uuid>.json`.
+
+    Args:
+        hostname: scheme and host of the echo360 instance
+        uuid: the section uuid
+        cache_dir: directory holding the caches of every course
+        ttl: seconds the course JSON and each media url stay fresh
+        refresh: ignore whatever is cached and rebuild it
+    """
+
+    VERSION = 1
+
+    def __init__(
+        self,
+        hostname,
+        uuid,
+        cache_dir=DEFAULT_CACHE_DIR,
+        ttl=DEFAULT_TTL,
+        refresh=False,
+    ):
+        host = urlsplit(hostname).netloc or hostname
+        self.path = os.path.join(cache_dir, host.replace(":", "_"), uuid + ".json")
+        self.ttl = ttl
+        self._course_data = None
+        self._fetched_at = 0.0
+        self._lessons = {}
+        self._dirty = False
+        if not refresh:
+            self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, "r") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        if data.get("version") != CourseCatalog.VERSION:
+            return
+        self._course_data = data.get("course_data")
+        self._fetched_at = data.get("fetched_at", 0.0)
+        self._lessons = data.get("lessons", {})
+
+    @property
+    def course_data(self):
+        """The cached course JSON, or None when it is missing or older than the TTL."""
+        if self._course_data is None or time.time() - self._fetched_at > self.ttl:
+            return None
+        return self._course_data
+
+    def set_course_data(self, course_data):
+        self._course_data = course_data
+        self._fetched_at = time.time()
+        self._dirty = True
+
+    def expire(self):
+        """Treat the cached course JSON as stale; lesson urls stay."""
+        self._fetched_at = 0.0
+
+    def media_url(self, lesson_id, lesson_fingerprint):
+        """Return `(found, url)` for a lesson whose JSON has not changed since."""
+        entry = self._lessons.get(str(lesson_id))
+        if entry is None or entry["fingerprint"] != lesson_fingerprint:
+            return False, None
+        if time.time() - entry.get("resolved_at", 0.0) > self.ttl:
+            return False, None
+        return True, entry["url"]
+
+    def set_media_url(self, lesson_id, lesson_fingerprint, url):
+        if not url:
+            # nothing found may just mean not yet, look again next time
+            self.forget_media_url(lesson_id)
+            return
+        self._lessons[str(lesson_id)] = dict(
+            fingerprint=lesson_fingerprint, url=url, resolved_at=time.time()
+        )
+        self._dirty = True
+
+    def forget_media_url(self, lesson_id):
+        """Drop a lesson's media url, e.g. after downloading from it failed."""
+        if self._lessons.pop(str(lesson_id), None) is not None:
+            self._dirty = True
+
+    def prune(self, lesson_ids):
+        """Forget lessons that are no longer part of the course."""
+        keep = {str(lesson_id) for lesson_id in lesson_ids}
+        for lesson_id in list(self._lessons):
+            if lesson_id not in keep:
+                del self._lessons[lesson_id]
+                self._dirty = True
+
+    def save(self):
+        if not self._dirty:
+            return
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(
+                dict(
+                    version=CourseCatalog.VERSION,
+                    fetched_at=self._fetched_at,
+                    course_data=self._course_data,
+                    lessons=self._lessons,
+                ),
+                f,
+            )
+        os.replace(tmp_path, self.path)
+        self._dirty = False
+        _LOGGER.debug("Saved course catalog to %s", self.path)
@@ -2,23 +2,34 @@ import json
 import re
 import sys
 
-import requests
+from gevent.pool import Pool
 import selenium
 from selenium.common.exceptions import NoSuchElementException
+from selenium.webdriver.common.by import By
 import logging
 
-from .videos import EchoVideos, EchoCloudVideos
+from .api import EchoApiClient
+from .echo_exceptions import EchoApiAuthError
+from .sessions import get_session_registry
+from .videos import BROWSER_LOCK, EchoVideos, EchoCloudVideos
 
 _LOGGER = logging.getLogger(__name__)
 
 
 class EchoCourse(object):
+    PAGE_SIZE = 100
+    # section-data pages fetched at the same time
+    PAGE_WORKERS = 4
+
     def __init__(self, uuid, hostname=None):
         self._course_id = None
         self._course_name = None
         self._uuid = uuid
         self._videos = None
         self._driver = None
+        self._api = None
+        self._catalog = None
+        self._course_data = None
         if hostname is None:
             self._hostname = "https://view.streaming.sydney.edu.au:8443"
         else:
@@ -30,10 +41,14 @@ class EchoCourse(object):
         if not self._videos:
             try:
                 course_data_json = self._get_course_data()
-                videos_json = course_data_json["section"]["presentations"][
-                    "pageContents"
-                ]
-                self._videos = EchoVideos(videos_json, self._driver)
+                presentations = course_data_json["section"]["presentations"]
+                self._videos = EchoVideos(
+                    self._iter_presentations(presentations),
+                    self._driver,
+                    api=self.api,
+                    catalog=self._catalog,
+                )
+                self._save_catalog()
             except KeyError as e:
                 self._blow_up(
                     "Unable to parse course videos from JSON (course_data)", e
@@ -57,17 +72,20 @@ class EchoCourse(object):
 
     @property
     def video_url(self):
-        return f"{self._hostname}/ess/client/api/sections/{self._uuid}/section-data.json?pageSize=100"
+        return self.page_url(1)
+
+    def page_url(self, page_index):
+        url = f"{self._hostname}/ess/client/api/sections/{self._uuid}/section-data.json?pageSize={self.PAGE_SIZE}"
+        if page_index > 1:
+            url += f"&pageIndex={page_index}"
+        return url
 
     @property
     def course_id(self):
         if self._course_id is None:
             try:
-                # driver = webdriver.PhantomJS() #TODO Redo this. Maybe use a singleton factory to request the lecho360 driver?s
-                self.driver.get(  # pyright: ignore
-                    self.url
-                )  # Initialize to establish the 'anon' cookie that Echo360 sends.
-                self.driver.get(self.video_url)  # pyright: ignore
+                # the 'anon' cookie Echo360 sends was set when the user logged in
+                # on the course page
                 course_data_json = self._get_course_data()
 
                 self._course_id = course_data_json["section"]["course"]["identifier"]
@@ -94,21 +112,123 @@ class EchoCourse(object):
     def nice_name(self):
         return "{0} - {1}".format(self.course_id, self.course_name)
 
+    @property
+    def api(self):
+        """Requests-based client sharing the cookies of the logged-in browser."""
+        if self._api is None:
+            self._api = EchoApiClient(self._hostname)
+            if not self._api.registry.has_cookies and self._driver is not None:
+                self._api.export_cookies(self._driver)
+        return self._api
+
+    def set_catalog(self, catalog):
+        """Cache course data and resolved media urls in `catalog` between runs."""
+        self._catalog = catalog
+
+    def save_catalog(self):
+        """Write the course data and the media urls resolved so far to the catalog."""
+        if self._catalog is not None:
+            self._catalog.save()
+
+    def _save_catalog(self):
+        if self._catalog is not None:
+            # lessons missing from the course data are gone upstream
+            self._catalog.prune(
+                part.lesson_id
+                for video in self._videos.videos
+                for part in video.get_all_parts()
+            )
+            self._catalog.save()
+
+    @property
+    def course_data(self):
+        return self._get_course_data()
+
+    def invalidate(self):
+        """Drop the course data and everything derived from it; refetched on use."""
+        self._course_data = None
+        self._course_id = None
+        self._course_name = None
+        self._videos = None
+        if self._catalog is not None:
+            self._catalog.expire()
+
     def _get_course_data(self):
+        # fetched once per run, course id, name and videos all read the same object
+        if self._course_data is not None:
+            return self._course_data
+        if self._catalog is not None and self._catalog.course_data is not None:
+            _LOGGER.debug("Using cached course data from %s", self._catalog.path)
+            self._course_data = self._catalog.course_data
+            return self._course_data
         try:
-            self.driver.get(self.video_url)  # pyright: ignore
-            _LOGGER.debug(
-                "Dumping course page at %s: %s",
-                self.video_url,
-                self._driver.page_source,  # pyright: ignore
+            course_data = self._fetch_course_data()
+        except EchoApiAuthError as e:
+            _LOGGER.debug("API refused course data (%s), using the browser", e)
+            course_data = self._get_course_data_from_browser()
+            # the browser may have renewed the session on the way
+            self.api.export_cookies(self._driver)
+        self._course_data = course_data
+        if self._catalog is not None:
+            self._catalog.set_course_data(course_data)
+        return course_data
+
+    def _fetch_course_data(self):
+        return self.api.section_data(self._uuid, page_size=self.PAGE_SIZE)
+
+    def _fetch_page(self, page_index):
+        try:
+            return self.api.section_data(
+                self._uuid, page_size=self.PAGE_SIZE, page_index=page_index
             )
-            json_str = self.driver.find_element_by_tag_name(  # pyright: ignore
-                "pre"
-            ).text
-        except ValueError as e:
-            raise Exception("Unable to retrieve JSON (course_data) from url", e)
-        self.course_data = json.loads(json_str)
-        return self.course_data
+        except EchoApiAuthError as e:
+            _LOGGER.debug("API refused page %d (%s), using the browser", page_index, e)
+            return self._browser_json(self.page_url(page_index))
+
+    def _iter_presentations(self, presentations):
+        """
+        Yield every presentation of the section, following the pagination.
+
+        The first page is already in `presentations`; the remaining ones are fetched
+        `PAGE_WORKERS` at a time and yielded as they arrive. Once all of them are in,
+        they are merged into the course data so the catalog caches the whole section.
+        """
+        contents = list(presentations["pageContents"])
+        yield from contents
+        total = presentations.get("totalResults")
+        if total is None or len(contents) >= total:
+            return
+        page_size = presentations.get("pageSize") or self.PAGE_SIZE
+        pages = range(2, (total + page_size - 1) // page_size + 1)
+        for page in Pool(self.PAGE_WORKERS).imap_unordered(self._fetch_page, pages):
+            page_contents = page["section"]["presentations"]["pageContents"]
+            contents.extend(page_contents)
+            yield from page_contents
+        _LOGGER.debug(
+            "Fetched %d presentations over %d pages", len(contents), pages[-1]
+        )
+        presentations["pageContents"] = contents
+        if self._catalog is not None:
+            self._catalog.set_course_data(self.course_data)
+
+    def _get_course_data_from_browser(self):
+        return self._browser_json(self.video_url)
+
+    def _browser_json(self, url):
+        with BROWSER_LOCK:
+            try:
+                self.driver.get(url)  # pyright: ignore
+                _LOGGER.debug(
+                    "Dumping course page at %s: %s",
+                    url,
+                    self._driver.page_source,  # pyright: ignore
+                )
+                json_str = self.driver.find_element(  # pyright: ignore
+                    By.TAG_NAME, "pre"
+                ).text
+            except ValueError as e:
+                raise Exception("Unable to retrieve JSON (course_data) from url", e)
+        return json.loads(json_str)
 
     def set_driver(self, driver):
         self._driver = driver
@@ -130,7 +250,14 @@ class EchoCloudCourse(EchoCourse):
             try:
                 course_data_json = self._get_course_data()
                 videos_json = course_data_json["data"]
-                self._videos = EchoCloudVideos(videos_json, self._driver, self.hostname)
+                self._videos = EchoCloudVideos(
+                    videos_json,
+                    self._driver,
+                    self.hostname,
+                    api=self.api,
+                    catalog=self._catalog,
+                )
+                self._save_catalog()
             except NoSuchElementException as e:
                 print("selenium cannot find given elements")
                 raise e
@@ -174,7 +301,10 @@ class EchoCloudCourse(EchoCourse):
     def nice_name(self):
         return self.course_name
 
-    def _get_course_data(self):
+    def _fetch_course_data(self):
+        return self.api.syllabus(self._uuid)
+
+    def _get_course_data_from_browser(self):
         try:
             self.driver.get(self.video_url)  # pyright: ignore
             _LOGGER.debug(
@@ -182,18 +312,14 @@ class EchoCloudCourse(EchoCourse):
                 self.video_url,
                 self._driver.page_source,  # pyright: ignore
             )
-            # use requests to retrieve data
-            session = requests.Session()
-            # load cookies
-            for cookie in self._driver.get_cookies():  # pyright: ignore
-                session.cookies.set(cookie["name"], cookie["value"])
-
-            r = session.get(self.video_url)
+            # the page load refreshes the session cookies, retry with those
+            registry = get_session_registry()
+            registry.load_cookies(self._driver.get_cookies())  # pyright: ignore
+            r = registry.get(self.video_url).get(self.video_url)
             if not r.ok:
                 raise Exception("Error: Failed to get m3u8 info for EchoCourse!")
 
             json_str = r.text
         except ValueError as e:
             raise Exception("Unable to retrieve JSON (course_data) from url", e)
-        self.course_data = json.loads(json_str)
-        return self.course_data
+        return json.loads(json_str)
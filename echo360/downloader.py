@@ -4,8 +4,17 @@ import sys
 import logging
 import re
 
+from gevent import Greenlet
+
 from .course import EchoCloudCourse
 from .echo_exceptions import EchoLoginError
+from .manifest import CourseManifest
+from .metrics import RunMetrics
+from .postprocess import PostProcessor
+from .retry import RetryPolicy
+from .scheduler import LectureScheduler
+from .sessions import get_session_registry
+from .videos import resolve_concurrently
 
 
 from pick import pick
@@ -41,6 +50,21 @@ class EchoDownloader(object):
         output_dir,
         date_range,
         interactive_mode=False,
+        downloader_kwargs=None,
+        concurrent_lectures=1,
+        max_requests=50,
+        adaptive_concurrency=False,
+        min_requests=4,
+        retry_policy=None,
+        mp4_connections=8,
+        sync=False,
+        feed_mode="hstack",
+        stream_mux=False,
+        ffmpeg_workers=1,
+        ffmpeg_timeout=None,
+        audio_codec="copy",
+        metrics_json=None,
+        metrics_prom=None,
     ):
         self._course = course
         root_path = "."
@@ -49,6 +73,32 @@ class EchoDownloader(object):
         self._output_dir = output_dir
         self._date_range = date_range
         self.interactive_mode = interactive_mode
+        # extra options forwarded to every hls_downloader.Downloader
+        self._downloader_kwargs = downloader_kwargs or {}
+        self._scheduler = LectureScheduler(
+            concurrent_lectures,
+            max_requests,
+            adaptive=adaptive_concurrency,
+            min_requests=min_requests,
+        )
+        get_session_registry().configure(pool_maxsize=max_requests)
+        self._retry_policy = retry_policy or RetryPolicy()
+        self._mp4_connections = mp4_connections
+        self._sync = sync
+        self._feed_mode = feed_mode
+        self._stream_mux = stream_mux
+        self._audio_codec = audio_codec
+        # with no workers, lectures are muxed inline before the next one starts
+        self._postprocessor = (
+            PostProcessor(ffmpeg_workers, timeout=ffmpeg_timeout)
+            if ffmpeg_workers > 0
+            else None
+        )
+        self._manifest = None
+        # per-request metrics are only collected when there is somewhere to put them
+        self._metrics_json = metrics_json
+        self._metrics_prom = metrics_prom
+        self._metrics = RunMetrics() if metrics_json or metrics_prom else None
 
         self.regex_replace_invalid = re.compile(r"[\\\\/:*?\"<>|]")
 
@@ -67,6 +117,8 @@ class EchoDownloader(object):
     def download_all(self):
         sys.stdout.write('>> Logging into "{0}"... '.format(self._course.url))
         sys.stdout.flush()
+        # the user has logged in by now, share the browser cookies with every session
+        get_session_registry().load_cookies(self._driver.get_cookies())
         sys.stdout.write(">> Retrieving echo360 Course Info... ")
         sys.stdout.flush()
         videos = self._course.get_videos().videos
@@ -109,6 +161,25 @@ class EchoDownloader(object):
             )
             videos_to_be_download = [videos_to_be_download[s[1]] for s in selected]
 
+        if self._sync:
+            self._manifest = CourseManifest(self._output_dir)
+            pending = [
+                (filename, video)
+                for filename, video in videos_to_be_download
+                if not self._manifest.is_complete(video.lesson_id)
+            ]
+            print(
+                ">> Sync: skipping {} lecture(s) already downloaded".format(
+                    len(videos_to_be_download) - len(pending)
+                )
+            )
+            videos_to_be_download = pending
+
+        # only the lectures that made it through the filters get their media looked up
+        resolve_concurrently(videos_to_be_download, lambda item: item[1].url)
+        print("Done!")
+        self._course.save_catalog()
+
         print("=" * 60)
         print("    Course: {0}".format(self._course.nice_name))
         print(
@@ -118,19 +189,102 @@ class EchoDownloader(object):
         )
         print("=" * 60)
 
-        downloaded_videos = []
-        for filename, video in videos_to_be_download:
-            if video.url is False:
-                print(
-                    ">> Skipping Lecture '{0}' as it says it does "
-                    "not contain any video.".format(filename)
-                )
-            else:
-                if video.download(self._output_dir, filename):
-                    downloaded_videos.insert(0, filename)
+        results = self._scheduler.run(videos_to_be_download, self._download_one)
+        if self._postprocessor is not None and self._postprocessor.pending:
+            print(">> Waiting for ffmpeg to finish...")
+            self._postprocessor.join()
+        # a lecture handed to the post-processor is done once its job succeeded
+        results = [
+            result.value if isinstance(result, Greenlet) else result
+            for result in results
+        ]
+        downloaded_videos = [
+            filename
+            for (filename, _), result in zip(videos_to_be_download, results)
+            if result
+        ]
+        downloaded_videos.reverse()
+        # lectures that failed to download dropped their cached media url
+        self._course.save_catalog()
         print(self.success_msg(self._course.course_name, downloaded_videos))
+        print(self._scheduler.stats.summary())
+        self._export_metrics()
+        _LOGGER.info("Connection reuse:\n%s", get_session_registry().summary())
         self._driver.close()
 
+    def _download_one(self, filename, video):
+        if video.url is False:
+            print(
+                ">> Skipping Lecture '{0}' as it says it does "
+                "not contain any video.".format(filename)
+            )
+            return False
+        # every lecture may use the whole request budget, the shared limiter keeps
+        # the run-wide total in check
+        downloader_kwargs = dict(
+            self._downloader_kwargs, **self._scheduler.downloader_kwargs
+        )
+        # retries are budgeted per lecture, shared by all of its tracks
+        downloader_kwargs.update(
+            retry_policy=self._retry_policy,
+            retry_budget=self._retry_policy.new_budget(),
+        )
+        lecture_metrics = None
+        if self._metrics is not None:
+            lecture_metrics = self._metrics.lecture(filename)
+            downloader_kwargs.update(metrics=lecture_metrics)
+        try:
+            result = video.download(
+                self._output_dir,
+                filename,
+                pool_size=self._scheduler.max_requests,
+                mp4_connections=self._mp4_connections,
+                feed_mode=self._feed_mode,
+                stream_mux=self._stream_mux,
+                postprocessor=self._postprocessor,
+                audio_codec=self._audio_codec,
+                **downloader_kwargs,
+            )
+        except Exception as e:
+            # e.g. an inline ffmpeg failing; the other lectures of the run carry on
+            _LOGGER.debug("Downloading %s failed", filename, exc_info=True)
+            print('ERROR: "{}" failed: {}'.format(filename, e))
+            result = False
+        if isinstance(result, Greenlet):
+            # still muxing, record the lecture once that worked out
+            result.link_value(
+                lambda job: self._finish(video, lecture_metrics, job.value)
+            )
+        else:
+            self._finish(video, lecture_metrics, result)
+        return result
+
+    def _finish(self, video, lecture_metrics, ok):
+        if lecture_metrics is not None:
+            lecture_metrics.finish(ok)
+        if ok:
+            self._record(video)
+        else:
+            # the url may have expired or been revoked, don't reuse it next run
+            video.forget_cached_url()
+
+    def _export_metrics(self):
+        if self._metrics is None:
+            return
+        for path, write in (
+            (self._metrics_json, self._metrics.write_json),
+            (self._metrics_prom, self._metrics.write_prometheus),
+        ):
+            if path:
+                try:
+                    write(path)
+                except EnvironmentError as e:
+                    print("ERROR: could not write metrics to {}: {}".format(path, e))
+
+    def _record(self, video):
+        if self._manifest is not None and video.output_paths:
+            self._manifest.record(video.lesson_id, video.output_paths, video.url)
+
     @property
     def useragent(self):
         return self._useragent
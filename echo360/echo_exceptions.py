@@ -5,3 +5,7 @@ class EchoLoginError(Exception):
 
 class HlsDownloaderError(Exception):
     pass
+
+
+class EchoApiAuthError(Exception):
+    """The JSON API refused the exported cookies; the browser has to take over."""
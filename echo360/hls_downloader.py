@@ -1,240 +1,482 @@
+import contextlib
 import ffmpy
 import gevent
+from gevent.event import Event
 from gevent.pool import Pool
-import requests
-import os, sys
+import logging
+import os
 import time
-import tqdm
-from requests.adapters import HTTPAdapter
+import requests
 
 from .echo_exceptions import HlsDownloaderError
+from .journal import DownloadJournal
+from .playlist import MasterPlaylist, parse_playlist
+from .progress import get_progress_display
+from .retry import FATAL, RetryPolicy
+from .sessions import get_session, get_session_registry
+from .streaming import DEFAULT_CHUNK_SIZE, iter_readinto
+
+_LOGGER = logging.getLogger(__name__)
+
+# Upper bound on memory held by segments that arrived ahead of their turn.
+DEFAULT_REORDER_BUFFER_BYTES = 64 * 1024 * 1024
 
 
-def urljoin(a: str, b: str):
-    """Join two urls together."""
-    # get url relative root path
-    a = a[: a.rfind("/") + 1]
-    # remove slashes at beginning if needed
-    while b[0] == "/":
-        b = b[1:]
-    return a + b
+def _range_headers(byterange):
+    if byterange is None:
+        return None
+    offset, length = byterange
+    return {"Range": "bytes={}-{}".format(offset, offset + length - 1)}
 
 
-def update_progress(current, total, title=None) -> None:
+def _byterange_window(chunks, byterange):
+    # for a server that ignored the Range header and sends the whole resource
+    offset, length = byterange
+    for chunk in chunks:
+        if offset >= len(chunk):
+            offset -= len(chunk)
+            continue
+        chunk = chunk[offset : offset + length]
+        offset = 0
+        length -= len(chunk)
+        yield chunk
+        if not length:
+            return
+
+
+class SegmentAssembler:
     """
-    Display or updates a console progress bar.
+    Write segments straight into the final output file in playlist order.
+
+    Every completed download hands its bytes to `put`, which writes it out at once if
+    it is the next expected segment and then drains whatever became contiguous. Segments
+    that arrive early wait in a reorder buffer; once that buffer would exceed
+    `max_buffer_bytes`, further early segments are spilled to a `.part` file next to the
+    output until their turn comes.
 
-    Args:
-        current (int): current progress
-        total (int): total progress
-        title (str): title of the progress bar
+    With a `journal`, every written segment is recorded so an interrupted download can
+    be picked up again: the assembler truncates the output back to the last journaled
+    segment and continues from there.
+
+    With a `sink`, segments go to that writable object (e.g. a pipe into ffmpeg)
+    instead, and `path` only names the spill files. A sink cannot be rewound, so it
+    takes neither a journal nor `put_stream`.
     """
-    if title is None:
-        title = "Progress"
-    barLength = 20  # Modify this to change the length of the progress bar
-    status = " {}/{}".format(current, total)
-    progress = float(current) / float(total)
-    if progress < 0:
-        progress = 0
-        status = "Halt...\r\n"
-    if progress >= 1:
-        progress = 1
-        status += " Done!\r\n"
-    block = "=" * int(round(barLength * progress))
-    if len(block) < barLength:
-        block += ">"
-    text = "\r{0}: [{1}] {2:.2f}% {3}".format(
-        title, block + " " * (barLength - len(block)), progress * 100, status
-    )
-    sys.stdout.write(text)
-    sys.stdout.flush()
+
+    def __init__(
+        self,
+        path,
+        total,
+        max_buffer_bytes=DEFAULT_REORDER_BUFFER_BYTES,
+        journal=None,
+        sink=None,
+    ):
+        self.path = path
+        self.total = total
+        self.max_buffer_bytes = max_buffer_bytes
+        self.journal = journal
+        self.next_index = 0
+        self.buffered_bytes = 0
+        self.finished = Event()
+        self._buffer = {}
+        self._spilled = {}
+        resume_index, resume_size = 0, 0
+        if journal is not None:
+            resume_index, resume_size = journal.completed_prefix()
+            if resume_index and os.path.getsize(path) < resume_size:
+                # the output is shorter than the journal claims, don't trust either
+                journal.reset()
+                resume_index, resume_size = 0, 0
+        if sink is not None:
+            self._file = sink
+        elif resume_index:
+            self._file = open(path, "r+b")
+            self._file.truncate(resume_size)
+            self._file.seek(resume_size)
+            self.next_index = resume_index
+        else:
+            self._file = open(path, "wb")
+        if self.next_index >= total:
+            self.close()
+
+    def put(self, index, data):
+        if index < self.next_index or index in self._buffer or index in self._spilled:
+            # already written or waiting, e.g. a segment that got retried twice
+            return
+        if index == self.next_index:
+            self._write(data)
+            self._drain()
+        elif self.buffered_bytes + len(data) <= self.max_buffer_bytes:
+            self._buffer[index] = data
+            self.buffered_bytes += len(data)
+        else:
+            spill_path = "{}.{}.part".format(self.path, index)
+            with open(spill_path, "wb") as f:
+                f.write(data)
+            self._spilled[index] = spill_path
+
+    def put_stream(self, index, chunks):
+        """
+        Write a segment chunk by chunk and return its size. Only valid for the next
+        expected segment.
+        """
+        if index != self.next_index:
+            raise HlsDownloaderError(
+                "Segment {} cannot be streamed before segment {}".format(
+                    index, self.next_index
+                )
+            )
+        start = self._file.tell()
+        try:
+            for chunk in chunks:
+                self._file.write(chunk)
+        except BaseException:
+            # drop the partial segment so a retry starts from a clean offset
+            self._file.seek(start)
+            self._file.truncate()
+            raise
+        size = self._file.tell() - start
+        self._advance(size)
+        self._drain()
+        return size
+
+    def _drain(self):
+        while not self.finished.is_set():
+            index = self.next_index
+            if index in self._buffer:
+                data = self._buffer.pop(index)
+                self.buffered_bytes -= len(data)
+            elif index in self._spilled:
+                spill_path = self._spilled.pop(index)
+                with open(spill_path, "rb") as f:
+                    data = f.read()
+                os.remove(spill_path)
+            else:
+                return
+            self._write(data)
+
+    def _write(self, data):
+        self._file.write(data)
+        self._advance(len(data))
+
+    def _advance(self, size):
+        if self.journal is not None:
+            self.journal.record(self.next_index, size)
+            if self.journal.due():
+                # the journal must never claim bytes that are not on disk yet
+                self._file.flush()
+                self.journal.save()
+        self.next_index += 1
+        if self.next_index >= self.total:
+            self.close()
+
+    def close(self):
+        """Close the output and discard anything still waiting for an earlier segment."""
+        if not self._file.closed:
+            self._file.close()
+            if self.journal is not None:
+                if self.next_index >= self.total:
+                    self.journal.remove()
+                else:
+                    self.journal.save()
+        for spill_path in self._spilled.values():
+            os.remove(spill_path)
+        self._spilled = {}
+        self._buffer = {}
+        self.buffered_bytes = 0
+        if self.next_index >= self.total:
+            self.finished.set()
 
 
 class Downloader:
-    def __init__(self, pool_size, retry=3, selenium_cookies=None):
-        self.pool = Pool(pool_size)
-        self.session = self._get_http_session(
-            pool_size, pool_size, retry, selenium_cookies
-        )
-        self.retry = retry
+    def __init__(
+        self,
+        pool_size,
+        retry=5,
+        selenium_cookies=None,
+        reorder_buffer_bytes=DEFAULT_REORDER_BUFFER_BYTES,
+        resume=True,
+        limiter=None,
+        stats=None,
+        session=None,
+        retry_policy=None,
+        retry_budget=None,
+        chunk_size=DEFAULT_CHUNK_SIZE,
+        pool=None,
+        progress=None,
+        metrics=None,
+    ):
+        # downloaders sharing a pool share its `pool_size` workers between them
+        self.pool = pool if pool is not None else Pool(pool_size)
+        registry = get_session_registry()
+        if selenium_cookies is not None and not registry.has_cookies:
+            registry.load_cookies(selenium_cookies)
+        # resolved from the shared registry once the playlist host is known
+        self.session = session
+        self.retry_policy = retry_policy or RetryPolicy(max_attempts=retry)
+        self.retry_budget = retry_budget or self.retry_policy.new_budget()
+        self.reorder_buffer_bytes = reorder_buffer_bytes
+        self.chunk_size = chunk_size
+        # the progress.ProgressDisplay to report to, the shared one if None
+        self.progress = progress if progress is not None else get_progress_display()
+        self.resume = resume
+        self.limiter = limiter
+        self.stats = stats
+        # a metrics.LectureMetrics, told about every request and segment
+        self.metrics = metrics
         self.dir = ""
         self.succed = {}
         self.failed = []
         self.ts_total = 0
+        self._assembler = None
+        self._task = None
+        # this downloader's segment greenlets, the pool may be shared with others
+        self._workers = []
         self._result_file_name = None
+        self._streaming = False
 
-    def _get_http_session(
-        self, pool_connections, pool_maxsize, max_retries, selenium_cookies=None
-    ):
-        session = requests.Session()
-        adapter = HTTPAdapter(
-            pool_connections=pool_connections,
-            pool_maxsize=pool_maxsize,
-            max_retries=max_retries,
-        )
-        session.mount("http://", adapter)
-        session.mount("https://", adapter)
-        if selenium_cookies is not None:
-            # load cookies
-            for cookie in selenium_cookies:
-                session.cookies.set(cookie["name"], cookie["value"])
-        return session
-
-    def run(self, m3u8_url, dir="", convert_to_mp4=True):
+    def run(self, m3u8_url, dir="", convert_to_mp4=True, output_name=None, sink=None):
+        """
+        Download every segment of `m3u8_url` into one file in `dir`.
+
+        With a `sink`, the ordered segment bytes are written to it instead and no
+        output file or journal is created; the sink is closed at the end.
+        """
         self.dir = dir
         if self.dir and not os.path.isdir(self.dir):
             os.makedirs(self.dir)
-        r = self.session.get(m3u8_url, timeout=10)
-        if r.ok:
-            body = r.content
-            if body:
-                # use set to prevent duplicates
-                ts_list = {
-                    urljoin(m3u8_url, n.strip())
-                    for n in body.decode().split("\n")
-                    if n and not n.startswith("#")
-                }
-                ts_list = list(ts_list)
-                # this is very hacky as well.. But idk how to overcome some m3u8 has nested
-                # m3u8 and some don't.
-                if len(ts_list) == 1 and ts_list[0].split(".")[-1] not in (
-                    "ts",
-                    "mp4",
-                    "m4s",
-                ):
-                    file_name = ts_list[0].split("/")[-1].split("?")[0]
-                    chunk_list_url = "{0}/{1}".format(
-                        m3u8_url[: m3u8_url.rfind("/")], file_name
+        if self.session is None:
+            self.session = get_session(m3u8_url)
+        playlist = self._load_playlist(m3u8_url)
+        if isinstance(playlist, MasterPlaylist):
+            # nested playlist, follow the best variant down to its segments
+            variant = playlist.best_variant()
+            playlist = self._load_playlist(variant.uri) if variant else None
+        if playlist is not None:
+            ts_list = self._segment_list(playlist)
+            if ts_list:
+                self.ts_total = len(ts_list)
+                file_name = playlist.segments[0].uri.split("/")[-1].split("?")[0]
+                root, ext = os.path.splitext(file_name)
+                if output_name is None:
+                    # name the output after the first segment, e.g. seg0_all.m4s
+                    output_name = root + "_all"
+                self._result_file_name = os.path.join(self.dir, output_name + ext)
+                journal = None
+                if self.resume and sink is None:
+                    journal = DownloadJournal.open(
+                        self._result_file_name, m3u8_url, total=self.ts_total
                     )
-                    r = self.session.get(chunk_list_url, timeout=20)
-                    if r.ok:
-                        body = r.content
-                        ts_list = [
-                            urljoin(m3u8_url, n.strip())
-                            for n in body.decode().split("\n")
-                            if n and not n.startswith("#")
-                        ]
-                    # re-retrieve to get all ts file list
-
-                ts_list = zip(ts_list, [n for n in range(len(ts_list))])
-                ts_list = list(ts_list)
-
-                if ts_list:
-                    self.ts_total = len(ts_list)
-                    self.ts_current = 0
-                    g1 = gevent.spawn(self._join_file)
-                    self._download(ts_list)
-                    g1.join()
-        else:
-            print("Failed status code: {}".format(r.status_code))
+                self._assembler = SegmentAssembler(
+                    self._result_file_name,
+                    self.ts_total,
+                    max_buffer_bytes=self.reorder_buffer_bytes,
+                    journal=journal,
+                    sink=sink,
+                )
+                self._streaming = sink is not None
+                self.ts_current = self._assembler.next_index
+                if self.ts_current:
+                    print(
+                        "  > Resuming after {}/{} segments".format(
+                            self.ts_current, self.ts_total
+                        )
+                    )
+                self._task = self.progress.task(
+                    output_name, segments=self.ts_total, done_segments=self.ts_current
+                )
+                try:
+                    self._download(ts_list[self.ts_current :])
+                finally:
+                    # when interrupted, stop the workers before their file goes away
+                    gevent.killall(self._workers)
+                    self._assembler.close()
+                    self._task.finish(ok=self._assembler.finished.is_set())
+                if not self._assembler.finished.is_set():
+                    raise HlsDownloaderError("Not all segments were downloaded.")
 
         if self._result_file_name is None:
             raise HlsDownloaderError("No video downloaded.")
-        infile_name = os.path.join(
-            self.dir, self._result_file_name.split(".")[0] + "_all.m4s"
-        )
-        self._result_file_name = infile_name
-
-        outfile_name = infile_name.split(".")[0] + ".mp4"
         print("Done!")
 
+    def _load_playlist(self, url):
+        r = self.session.get(url, timeout=20)
+        if not r.ok:
+            print("Failed status code: {}".format(r.status_code))
+            return None
+        if not r.content:
+            return None
+        try:
+            return parse_playlist(r.content, base_url=url)
+        except ValueError as e:
+            raise HlsDownloaderError("Invalid playlist at {}: {}".format(url, e))
+
+    @staticmethod
+    def _segment_list(playlist):
+        """Return `(url, index, byterange)` for every segment, init sections included."""
+        ts_list = []
+        init_section = None
+        for segment in playlist.segments:
+            if (
+                segment.init_section is not None
+                and segment.init_section != init_section
+            ):
+                init_section = segment.init_section
+                ts_list.append((init_section.uri, len(ts_list), init_section.byterange))
+            ts_list.append((segment.uri, len(ts_list), segment.byterange))
+        return ts_list
+
     def _download(self, ts_list):
-        if len(ts_list) == 1:
+        if not ts_list:
+            return
+        if len(ts_list) == 1 and not self._streaming:
             self._worker_single(ts_list[0])
         else:
-            self.pool.map(self._worker, ts_list)
+            for ts_tuple in ts_list:
+                self._workers.append(self.pool.spawn(self._worker, ts_tuple))
+            gevent.joinall(self._workers, raise_error=True)
         if self.failed:
-            ts_list = self.failed
-            self.failed = []
-            self._download(ts_list)
+            print("{} segment(s) failed:".format(len(self.failed)))
+            for url, index, reason in sorted(self.failed, key=lambda f: f[1]):
+                print("  > segment {} ({}): {}".format(index, url, reason))
+            raise HlsDownloaderError(
+                "{} segment(s) failed to download".format(len(self.failed))
+            )
 
     def _worker_single(self, ts_tuple):
-        url = ts_tuple[0]
-        index = ts_tuple[1]
-        retry = self.retry
-        update_progress(
-            self.ts_current, self.ts_total, title="  > {}".format("Progress")
-        )
-        while retry:
-            try:
-                r = self.session.get(url, stream=True, timeout=20)
-                total_size = int(r.headers.get("content-length", 0))
-                block_size = 1024  # 1 kilobyte
-                file_name = url.split("/")[-1].split("?")[0]
-                result_full_path = os.path.join(self.dir, file_name)
-                with tqdm.tqdm(total=total_size, unit="iB", unit_scale=True) as pbar:
-                    with open(result_full_path, "wb") as f:
-                        for data in r.iter_content(block_size):
-                            pbar.update(len(data))
-                            f.write(data)
-                self.succed[index] = file_name
-                self.ts_current += 1
-                return
-            except EnvironmentError as e:
-                print("\r\nError in writing file: {}".format(e))
-                raise HlsDownloaderError
-            except:
-                retry -= 1
-        sys.stdout.write("[FAIL]")
-        self.failed.append((url, index))
+        self._with_retries(ts_tuple, self._fetch_stream)
 
     def _worker(self, ts_tuple):
+        self._with_retries(ts_tuple, self._fetch)
+
+    def _with_retries(self, ts_tuple, fetch):
         url = ts_tuple[0]
         index = ts_tuple[1]
-        retry = self.retry
-        update_progress(
-            self.ts_current, self.ts_total, title="  > {}".format("Progress")
-        )
-        while retry:
+        attempt = 0
+        while True:
+            attempt += 1
+            r = None
             try:
-                r = self.session.get(url, timeout=20)
-                if r.ok:
-                    file_name = url.split("/")[-1].split("?")[0]
-                    with open(os.path.join(self.dir, file_name), "wb") as f:
-                        f.write(r.content)
-                    self.succed[index] = file_name
-                    self.ts_current += 1
-                    update_progress(
-                        self.ts_current,
-                        self.ts_total,
-                        title="  > {}".format("Progress"),
-                    )
-                    return
+                r = fetch(*ts_tuple)
+            except requests.RequestException as e:
+                kind, reason = self.retry_policy.classify(exception=e)
             except EnvironmentError as e:
-                print("\r\nError in writing file: {}".format(e))
+                print("Error in writing file: {}".format(e))
                 raise HlsDownloaderError
-            except:
-                retry -= 1
-        sys.stdout.write("[FAIL]")
-        self.failed.append((url, index))
-
-    def _join_file(self):
-        index = 0
-        outfile = ""
-        while index < self.ts_total:
-            file_name = self.succed.get(index, "")
-            if file_name:
-                if self._result_file_name is None:
-                    self._result_file_name = file_name
-                infile = open(os.path.join(self.dir, file_name), "rb")
-                if not outfile:
-                    outfile = open(
-                        os.path.join(
-                            self.dir,
-                            file_name.split(".")[0]
-                            + "_all."
-                            + file_name.split(".")[-1],
-                        ),
-                        "wb",
-                    )
-                outfile.write(infile.read())
-                infile.close()
-                os.remove(os.path.join(self.dir, file_name))
-                index += 1
             else:
-                time.sleep(1)
-        if outfile:
-            outfile.close()
+                if r.ok:
+                    self._observe_segment(url, attempt)
+                    return
+                kind, reason = self.retry_policy.classify(response=r)
+
+            if kind == FATAL:
+                break
+            if attempt >= self.retry_policy.max_attempts:
+                reason += " (gave up after {} attempts)".format(attempt)
+                break
+            if not self.retry_budget.spend():
+                reason += " (retry budget exhausted)"
+                break
+            delay = self.retry_policy.delay(attempt, r)
+            _LOGGER.debug(
+                "Segment %d attempt %d failed with %s, retrying in %.1fs",
+                index,
+                attempt,
+                reason,
+                delay,
+            )
+            gevent.sleep(delay)
+        self._task.update(failed=1)
+        self._observe_segment(url, attempt, ok=False)
+        self.failed.append((url, index, reason))
+
+    def _fetch_stream(self, url, index, byterange=None):
+        with self._request_slot():
+            sent = time.monotonic()
+            r = None
+            try:
+                r = self.session.get(
+                    url, stream=True, timeout=20, headers=_range_headers(byterange)
+                )
+                if not r.ok:
+                    self._observe(url, sent, status=r.status_code, response=r)
+                    return r
+                chunks = iter_readinto(
+                    r,
+                    chunk_size=self.chunk_size,
+                    on_progress=lambda nbytes: self._task.update(nbytes=nbytes),
+                )
+                if byterange is not None and r.status_code == 200:
+                    chunks = _byterange_window(chunks, byterange)
+                # what was written, the Content-Length is missing when chunked and
+                # counts the encoded body when compressed
+                size = self._assembler.put_stream(index, chunks)
+            except requests.RequestException:
+                self._observe(url, sent, error=True)
+                raise
+            finally:
+                # hands the connection back, also for a body that was never read
+                if r is not None:
+                    r.close()
+            self._observe(url, sent, size, r.status_code, response=r)
+        self.succed[index] = size
+        self._count_bytes(size)
+        self.ts_current += 1
+        self._task.update(segments=1)
+        return r
+
+    def _fetch(self, url, index, byterange=None):
+        with self._request_slot():
+            sent = time.monotonic()
+            try:
+                r = self.session.get(url, timeout=20, headers=_range_headers(byterange))
+            except requests.RequestException:
+                self._observe(url, sent, error=True)
+                raise
+            self._observe(url, sent, len(r.content), r.status_code, response=r)
+        if r.ok:
+            content = r.content
+            if byterange is not None and r.status_code == 200:
+                # the server ignored the Range header and sent the whole resource
+                offset, length = byterange
+                content = content[offset : offset + length]
+            self._assembler.put(index, content)
+            self.succed[index] = len(content)
+            self._count_bytes(len(content))
+            self.ts_current += 1
+            self._task.update(nbytes=len(content), segments=1)
+        return r
+
+    def _request_slot(self):
+        # the limiter is shared between downloaders to cap in-flight requests run-wide
+        if self.limiter is None:
+            return contextlib.nullcontext()
+        return self.limiter
+
+    def _observe(self, url, sent, nbytes=0, status=None, error=False, response=None):
+        # measured from when the request got its slot: the wait for the slot is the
+        # limiter's own doing and would read as a slow server to an adaptive limiter
+        latency = time.monotonic() - sent
+        # feed the request outcome back so an adaptive limiter can tune itself
+        if self.limiter is not None:
+            self.limiter.record(latency, nbytes=nbytes, status=status, error=error)
+        if self.metrics is not None:
+            self.metrics.record_request(
+                url,
+                latency,
+                nbytes=nbytes,
+                status=status,
+                ttfb=response.elapsed.total_seconds() if response is not None else None,
+                error=error,
+            )
+
+    def _observe_segment(self, url, attempts, ok=True):
+        if self.metrics is not None:
+            self.metrics.record_segment(url, attempts, ok=ok)
+
+    def _count_bytes(self, nbytes):
+        if self.stats is not None:
+            self.stats.add(nbytes)
 
     @property
     def result_file_name(self) -> str:
@@ -0,0 +1,78 @@
+import json
+import os
+import time
+from urllib.parse import urlsplit
+
+
+def _strip_query(url):
+    # signed CDN urls carry a fresh token every run, the path identifies the content
+    return urlsplit(url)._replace(query="", fragment="").geturl()
+
+
+class DownloadJournal:
+    """
+    Sidecar file recording which parts of a partial download are safely on disk.
+
+    The journal lives next to the output as `<output>.journal` and maps a part key to
+    its size in bytes: segment indices for HLS downloads, byte offsets for MP4 files.
+    It only ever claims data that was flushed to the output before `save` was called,
+    so a rerun can trust it and skip those parts.
+    """
+
+    SUFFIX = ".journal"
+
+    def __init__(self, output_path, url, total=None, save_interval=1.0):
+        self.path = output_path + DownloadJournal.SUFFIX
+        self.url = url
+        self.total = total
+        self.save_interval = save_interval
+        self.parts = {}
+        self._last_save = 0.0
+
+    @classmethod
+    def open(cls, output_path, url, total=None, **kwargs):
+        """Load the journal for `output_path`, or start an empty one if it is stale."""
+        journal = cls(output_path, url, total, **kwargs)
+        if not os.path.exists(output_path):
+            return journal
+        try:
+            with open(journal.path, "r") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return journal
+        if _strip_query(data.get("url", "")) != _strip_query(url):
+            return journal
+        if total is not None and data.get("total") != total:
+            return journal
+        journal.parts = {int(k): v for k, v in data.get("parts", {}).items()}
+        return journal
+
+    def completed_prefix(self):
+        """Return (count, size) of the consecutive parts 0, 1, 2, ... on record."""
+        count = 0
+        size = 0
+        while count in self.parts:
+            size += self.parts[count]
+            count += 1
+        return count, size
+
+    def record(self, key, size):
+        self.parts[key] = size
+
+    def due(self):
+        return time.monotonic() - self._last_save >= self.save_interval
+
+    def save(self):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"url": self.url, "total": self.total, "parts": self.parts}, f)
+        os.replace(tmp_path, self.path)
+        self._last_save = time.monotonic()
+
+    def reset(self):
+        self.parts = {}
+        self.remove()
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
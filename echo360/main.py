@@ -1,3 +1,9 @@
+# Patch before anything imports ssl/socket so the gevent segment pools actually
+# overlap their network I/O instead of running one request at a time.
+from gevent import monkey
+
+monkey.patch_all()
+
 import argparse
 from sys import version_info
 import os
@@ -9,8 +15,11 @@ import selenium
 from selenium.common.exceptions import InvalidArgumentException
 from datetime import datetime
 from .echo_exceptions import EchoLoginError
+from .catalog import CourseCatalog
 from .course import EchoCourse, EchoCloudCourse
 from .downloader import EchoDownloader
+from .retry import RetryPolicy
+from .videos import FEED_MODES
 
 _DEFAULT_OUTPUT_PATH = "./out"
 _DEFAULT_BEFORE_DATE = datetime(2900, 1, 1).date()
@@ -75,6 +84,164 @@ def handle_args():
         help="Interactively pick the lectures you want, instead of download all \
                               (default) or based on dates .",
     )
+    parser.add_argument(
+        "--reorder-buffer-mb",
+        dest="reorder_buffer_mb",
+        type=int,
+        default=64,
+        help="Memory (in MB) used to hold segments that finish ahead of their turn \
+                              before they get spilled to disk (default: 64).",
+        metavar="MB",
+    )
+    parser.add_argument(
+        "--concurrent-lectures",
+        "-j",
+        dest="concurrent_lectures",
+        type=int,
+        default=1,
+        help="Number of lectures to download at the same time, newest first \
+                              (default: 1).",
+        metavar="N",
+    )
+    parser.add_argument(
+        "--max-requests",
+        dest="max_requests",
+        type=int,
+        default=50,
+        help="Maximum number of segment requests in flight across all \
+                              lectures (default: 50).",
+        metavar="N",
+    )
+    parser.add_argument(
+        "--adaptive-concurrency",
+        dest="adaptive_concurrency",
+        action="store_true",
+        default=False,
+        help="Grow and shrink the number of in-flight segment requests based on \
+                              latency, throughput and server errors, between \
+                              --min-requests and --max-requests.",
+    )
+    parser.add_argument(
+        "--min-requests",
+        dest="min_requests",
+        type=int,
+        default=4,
+        help="Lowest number of in-flight requests the adaptive mode may drop to \
+                              (default: 4).",
+        metavar="N",
+    )
+    parser.add_argument(
+        "--retry-budget",
+        dest="retry_budget",
+        type=int,
+        default=200,
+        help="Total number of segment retries allowed per lecture before it is \
+                              given up (default: 200).",
+        metavar="N",
+    )
+    parser.add_argument(
+        "--mp4-connections",
+        dest="mp4_connections",
+        type=int,
+        default=8,
+        help="Number of concurrent byte-range requests used for videos served as \
+                              a single mp4 file, 1 to disable (default: 8).",
+        metavar="N",
+    )
+    parser.add_argument(
+        "--chunk-size-kb",
+        dest="chunk_size_kb",
+        type=int,
+        default=1024,
+        help="Read buffer size (in KB) used when streaming large responses to \
+                              disk (default: 1024).",
+        metavar="KB",
+    )
+    parser.add_argument(
+        "--feed-mode",
+        dest="feed_mode",
+        choices=FEED_MODES,
+        default="hstack",
+        help="How to save lectures with several video feeds: 'hstack' re-encodes \
+                              them side by side into one video (default), 'tracks' \
+                              stream copies them as tracks of one .mkv file and \
+                              'separate' keeps one file per feed. Only the first \
+                              mode transcodes.",
+    )
+    parser.add_argument(
+        "--stream-mux",
+        action="store_true",
+        default=False,
+        dest="stream_mux",
+        help="Pipe HLS segments straight into ffmpeg while downloading, instead \
+                              of writing the tracks to disk first. Downloads in this \
+                              mode cannot be resumed.",
+    )
+    parser.add_argument(
+        "--audio-codec",
+        default="copy",
+        dest="audio_codec",
+        help="What to do with the audio when muxing a lecture: 'copy' keeps it \
+                              as it is whenever mp4 can carry it (default), any other \
+                              value is the ffmpeg encoder to transcode it with, e.g. \
+                              'aac' or 'ac3'.",
+    )
+    parser.add_argument(
+        "--ffmpeg-workers",
+        type=int,
+        default=1,
+        dest="ffmpeg_workers",
+        help="Number of ffmpeg processes muxing finished lectures in the \
+                              background while the next ones download (default: 1). \
+                              0 muxes every lecture before starting the next one.",
+    )
+    parser.add_argument(
+        "--ffmpeg-timeout",
+        type=float,
+        default=0,
+        dest="ffmpeg_timeout",
+        help="Give up on muxing a lecture after this many minutes \
+                              (default: no limit).",
+    )
+    parser.add_argument(
+        "--metrics-json",
+        dest="metrics_json",
+        default=None,
+        help="Write per-lecture and per-host request metrics (bytes, latency, \
+                              time to first byte, retries, statuses) to this JSON file.",
+        metavar="PATH",
+    )
+    parser.add_argument(
+        "--metrics-prom",
+        dest="metrics_prom",
+        default=None,
+        help="Write the run's request metrics in the Prometheus text format, e.g. \
+                              into node_exporter's textfile collector directory.",
+        metavar="PATH",
+    )
+    parser.add_argument(
+        "--sync",
+        action="store_true",
+        default=False,
+        help="Keep a manifest in the course folder and only download lectures \
+                              that are new or failed in an earlier run.",
+    )
+    parser.add_argument(
+        "--refresh-catalog",
+        action="store_true",
+        default=False,
+        dest="refresh_catalog",
+        help="Ignore the cached course catalog and fetch everything again.",
+    )
+    parser.add_argument(
+        "--catalog-ttl",
+        dest="catalog_ttl",
+        type=float,
+        default=6,
+        help="Hours the cached course data stays fresh (default: 6). Lectures \
+                              that did not change are never resolved again.",
+        metavar="HOURS",
+    )
     parser.add_argument(
         "--debug",
         action="store_true",
@@ -93,6 +260,11 @@ def handle_args():
     )
 
     args = vars(parser.parse_args())
+    for option in ("concurrent_lectures", "max_requests", "min_requests"):
+        if args[option] < 1:
+            parser.error("--{} must be at least 1".format(option.replace("_", "-")))
+    if args["adaptive_concurrency"] and args["min_requests"] > args["max_requests"]:
+        parser.error("--min-requests cannot be larger than --max-requests")
     course_url = args["url"]
 
     course_hostname = re.search(
@@ -134,6 +306,24 @@ def handle_args():
         args["interactive"],
         args["enable_degbug"],
         args["echo360cloud"],
+        args["reorder_buffer_mb"],
+        args["concurrent_lectures"],
+        args["max_requests"],
+        args["adaptive_concurrency"],
+        args["min_requests"],
+        args["retry_budget"],
+        args["mp4_connections"],
+        args["chunk_size_kb"],
+        args["refresh_catalog"],
+        args["catalog_ttl"],
+        args["sync"],
+        args["feed_mode"],
+        args["stream_mux"],
+        args["ffmpeg_workers"],
+        args["ffmpeg_timeout"],
+        args["audio_codec"],
+        args["metrics_json"],
+        args["metrics_prom"],
     )
 
 
@@ -147,6 +337,24 @@ def main():
         interactive_mode,
         enable_degbug,
         usingEcho360Cloud,
+        reorder_buffer_mb,
+        concurrent_lectures,
+        max_requests,
+        adaptive_concurrency,
+        min_requests,
+        retry_budget,
+        mp4_connections,
+        chunk_size_kb,
+        refresh_catalog,
+        catalog_ttl,
+        sync,
+        feed_mode,
+        stream_mux,
+        ffmpeg_workers,
+        ffmpeg_timeout,
+        audio_codec,
+        metrics_json,
+        metrics_prom,
     ) = handle_args()
 
     setup_logging(enable_degbug)
@@ -169,21 +377,42 @@ def main():
         course_uuid = course_uuid.group()  # retrieve the last part of the URL
         course = EchoCloudCourse(course_uuid, course_hostname)
     else:
-        # import it here for monkey patching gevent, to fix the followings:
-        # MonkeyPatchWarning: Monkey-patching ssl after ssl has already been
-        # imported may lead to errors, including RecursionError on Python 3.6.
-        from . import hls_downloader
-
         course_uuid = re.search("[^/]+(?=/$|$)", course_url)
         if course_uuid is None:
             raise ValueError("Invalid URL")
         course_uuid = course_uuid.group()  # retrieve the last part of the URL
         course = EchoCourse(course_uuid, course_hostname)
+    course.set_catalog(
+        CourseCatalog(
+            course.hostname,
+            course.uuid,
+            ttl=catalog_ttl * 3600,
+            refresh=refresh_catalog,
+        )
+    )
     downloader = EchoDownloader(
         course,
         output_path,
         date_range=(after_date, before_date),
         interactive_mode=interactive_mode,
+        downloader_kwargs=dict(
+            reorder_buffer_bytes=reorder_buffer_mb * 1024 * 1024,
+            chunk_size=chunk_size_kb * 1024,
+        ),
+        concurrent_lectures=concurrent_lectures,
+        max_requests=max_requests,
+        adaptive_concurrency=adaptive_concurrency,
+        min_requests=min_requests,
+        retry_policy=RetryPolicy(budget=retry_budget),
+        mp4_connections=mp4_connections,
+        sync=sync,
+        feed_mode=feed_mode,
+        stream_mux=stream_mux,
+        ffmpeg_workers=ffmpeg_workers,
+        ffmpeg_timeout=ffmpeg_timeout * 60 or None,
+        audio_codec=audio_codec,
+        metrics_json=metrics_json,
+        metrics_prom=metrics_prom,
     )
 
     downloader._driver.get(course_url)
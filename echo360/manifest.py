@@ -0,0 +1,56 @@
+import json
+import os
+import time
+
+
+class CourseManifest:
+    """
+    Record of the lectures that finished downloading into a course directory.
+
+    Stored as `<course dir>/.echo360-manifest.json`, mapping each lesson id to the
+    files it was saved as (one per feed with the "separate" feed mode) and their
+    sizes, the url it came from and when it completed. A lecture counts as complete
+    only while all of its files are still there with the same sizes, so deleting a
+    file is enough to have it downloaded again.
+    """
+
+    FILENAME = ".echo360-manifest.json"
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.path = os.path.join(directory, CourseManifest.FILENAME)
+        self.lectures = {}
+        try:
+            with open(self.path, "r") as f:
+                self.lectures = json.load(f).get("lectures", {})
+        except (OSError, ValueError):
+            pass
+
+    def is_complete(self, lesson_id):
+        entry = self.lectures.get(str(lesson_id))
+        if entry is None:
+            return False
+        for filename, size in entry["files"].items():
+            path = os.path.join(self.directory, filename)
+            if not os.path.isfile(path) or os.path.getsize(path) != size:
+                return False
+        return True
+
+    def record(self, lesson_id, paths, url):
+        """Mark `lesson_id` complete with its outputs at `paths`, and save."""
+        self.lectures[str(lesson_id)] = dict(
+            files={
+                os.path.relpath(path, self.directory): os.path.getsize(path)
+                for path in paths
+            },
+            url=url,
+            completed_at=time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        )
+        self.save()
+
+    def save(self):
+        os.makedirs(self.directory, exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"lectures": self.lectures}, f, indent=1)
+        os.replace(tmp_path, self.path)
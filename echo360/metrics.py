@@ -0,0 +1,376 @@
+"""
+Per-request download metrics, aggregated per lecture and per run.
+
+Every segment or range request reports its bytes, time to first byte, total latency
+and HTTP status; every segment reports how many attempts it took. `RunMetrics` sums
+them up per lecture and per host and exports a JSON summary or a Prometheus
+textfile-collector file, e.g. to spot a slow CDN or a regression across runs.
+"""
+
+import json
+import os
+import time
+from collections import Counter
+from urllib.parse import urlparse
+
+# seconds, shared by the latency and time to first byte histograms
+LATENCY_BUCKETS = (0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class Histogram:
+    """Fixed-bucket histogram, cheap enough to update for every request."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        # the last count is the +Inf bucket
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        i = 0
+        while i < len(self.buckets) and value > self.buckets[i]:
+            i += 1
+        self.counts[i] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def merge(self, other):
+        for i, count in enumerate(other.counts):
+            self.counts[i] += count
+        self.count += other.count
+        self.sum += other.sum
+        self.max = max(self.max, other.max)
+
+    def quantile(self, q):
+        """Estimate a quantile by interpolating inside its bucket, as Prometheus does."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                lower = self.buckets[i - 1] if i else 0.0
+                # never beyond the largest value actually seen
+                upper = (
+                    min(self.buckets[i], self.max)
+                    if i < len(self.buckets)
+                    else self.max
+                )
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+        return self.max
+
+    def summary(self):
+        if not self.count:
+            return None
+        return dict(
+            count=self.count,
+            mean=round(self.sum / self.count, 4),
+            p50=round(self.quantile(0.5), 4),
+            p95=round(self.quantile(0.95), 4),
+            p99=round(self.quantile(0.99), 4),
+            max=round(self.max, 4),
+        )
+
+
+class TransferMetrics:
+    """Request and segment counters for one scope, e.g. one host of one lecture."""
+
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.statuses = Counter()
+        self.bytes = 0
+        self.segments = 0
+        self.failed_segments = 0
+        self.retries = 0
+        self.latency = Histogram()
+        self.ttfb = Histogram()
+        self.first_started = None
+        self.last_finished = None
+
+    def record_request(self, latency, nbytes=0, status=None, ttfb=None, error=False):
+        finished = time.monotonic()
+        started = finished - latency
+        if self.first_started is None or started < self.first_started:
+            self.first_started = started
+        if self.last_finished is None or finished > self.last_finished:
+            self.last_finished = finished
+        self.requests += 1
+        self.bytes += nbytes
+        # a connection error has no status, count it as such
+        self.statuses["error" if error or status is None else str(status)] += 1
+        if error or status is None or status >= 400:
+            self.errors += 1
+        self.latency.observe(latency)
+        if ttfb is not None:
+            self.ttfb.observe(ttfb)
+
+    def record_segment(self, attempts, ok=True):
+        self.segments += 1
+        self.retries += max(attempts - 1, 0)
+        if not ok:
+            self.failed_segments += 1
+
+    def merge(self, other):
+        self.requests += other.requests
+        self.errors += other.errors
+        self.statuses.update(other.statuses)
+        self.bytes += other.bytes
+        self.segments += other.segments
+        self.failed_segments += other.failed_segments
+        self.retries += other.retries
+        self.latency.merge(other.latency)
+        self.ttfb.merge(other.ttfb)
+        if other.first_started is not None:
+            if self.first_started is None or other.first_started < self.first_started:
+                self.first_started = other.first_started
+            if self.last_finished is None or other.last_finished > self.last_finished:
+                self.last_finished = other.last_finished
+
+    @property
+    def elapsed(self):
+        if self.first_started is None:
+            return 0.0
+        return self.last_finished - self.first_started
+
+    def summary(self):
+        elapsed = self.elapsed
+        return dict(
+            requests=self.requests,
+            errors=self.errors,
+            statuses=dict(self.statuses),
+            bytes=self.bytes,
+            segments=self.segments,
+            failed_segments=self.failed_segments,
+            retries=self.retries,
+            elapsed_s=round(elapsed, 3),
+            throughput_mb_s=(
+                round(self.bytes / 1024 / 1024 / elapsed, 3) if elapsed else None
+            ),
+            latency_s=self.latency.summary(),
+            ttfb_s=self.ttfb.summary(),
+        )
+
+
+def _merged(metrics):
+    total = TransferMetrics()
+    for m in metrics:
+        total.merge(m)
+    return total
+
+
+class LectureMetrics:
+    """
+    Metrics of one lecture, kept per host so a slow CDN stands out.
+
+    Handed to every downloader working on the lecture as `metrics`.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.ok = None
+        self.hosts = {}
+
+    def _host(self, url):
+        host = urlparse(url).netloc
+        if host not in self.hosts:
+            self.hosts[host] = TransferMetrics()
+        return self.hosts[host]
+
+    def record_request(
+        self, url, latency, nbytes=0, status=None, ttfb=None, error=False
+    ):
+        self._host(url).record_request(
+            latency, nbytes=nbytes, status=status, ttfb=ttfb, error=error
+        )
+
+    def record_segment(self, url, attempts, ok=True):
+        self._host(url).record_segment(attempts, ok=ok)
+
+    def finish(self, ok):
+        self.ok = bool(ok)
+
+    @property
+    def total(self):
+        return _merged(self.hosts.values())
+
+    def summary(self):
+        return dict(
+            name=self.name,
+            ok=self.ok,
+            **self.total.summary(),
+            hosts={host: m.summary() for host, m in self.hosts.items()},
+        )
+
+
+class RunMetrics:
+    """All lectures of a run, see `lecture`, plus the JSON and Prometheus exports."""
+
+    def __init__(self):
+        self.started = time.time()
+        self.lectures = []
+
+    def lecture(self, name):
+        lecture = LectureMetrics(name)
+        self.lectures.append(lecture)
+        return lecture
+
+    def by_host(self):
+        hosts = {}
+        for lecture in self.lectures:
+            for host, m in lecture.hosts.items():
+                hosts.setdefault(host, TransferMetrics()).merge(m)
+        return hosts
+
+    def _lecture_counts(self):
+        return dict(
+            lectures_ok=sum(1 for lecture in self.lectures if lecture.ok),
+            lectures_failed=sum(1 for lecture in self.lectures if lecture.ok is False),
+        )
+
+    def summary(self):
+        hosts = self.by_host()
+        return dict(
+            started=self.started,
+            **self._lecture_counts(),
+            **_merged(hosts.values()).summary(),
+            hosts={host: m.summary() for host, m in hosts.items()},
+            lectures=[lecture.summary() for lecture in self.lectures],
+        )
+
+    def write_json(self, path):
+        _write_atomic(path, json.dumps(self.summary(), indent=2) + "\n")
+
+    def write_prometheus(self, path):
+        """
+        Write the run-level metrics in the Prometheus text format, per host.
+
+        Meant for node_exporter's textfile collector; lectures are left out to keep
+        the label cardinality bounded.
+        """
+        lines = []
+        summary = self._lecture_counts()
+
+        def metric(name, kind, doc, samples):
+            lines.append("# HELP {} {}".format(name, doc))
+            lines.append("# TYPE {} {}".format(name, kind))
+            for labels, value in samples:
+                lines.append("{}{} {}".format(name, _labels(labels), _number(value)))
+
+        hosts = sorted(self.by_host().items())
+        metric(
+            "echo360_download_requests_total",
+            "counter",
+            "HTTP requests for segments and ranges, by response status.",
+            [
+                (dict(host=host, status=status), count)
+                for host, m in hosts
+                for status, count in sorted(m.statuses.items())
+            ],
+        )
+        metric(
+            "echo360_download_bytes_total",
+            "counter",
+            "Bytes downloaded.",
+            [(dict(host=host), m.bytes) for host, m in hosts],
+        )
+        metric(
+            "echo360_download_segments_total",
+            "counter",
+            "Segments and ranges downloaded, by outcome.",
+            [
+                (dict(host=host, result=result), count)
+                for host, m in hosts
+                for result, count in (
+                    ("ok", m.segments - m.failed_segments),
+                    ("failed", m.failed_segments),
+                )
+            ],
+        )
+        metric(
+            "echo360_download_retries_total",
+            "counter",
+            "Requests repeated after a failed attempt.",
+            [(dict(host=host), m.retries) for host, m in hosts],
+        )
+        for name, attr, doc in (
+            (
+                "echo360_download_request_duration_seconds",
+                "latency",
+                "Time from sending a request to the end of its body.",
+            ),
+            (
+                "echo360_download_ttfb_seconds",
+                "ttfb",
+                "Time from sending a request to its response headers.",
+            ),
+        ):
+            samples = []
+            for host, m in hosts:
+                samples += _histogram_samples(name, dict(host=host), getattr(m, attr))
+            lines.append("# HELP {} {}".format(name, doc))
+            lines.append("# TYPE {} histogram".format(name))
+            lines.extend(samples)
+        metric(
+            "echo360_download_lectures",
+            "gauge",
+            "Lectures of the last run, by outcome.",
+            [
+                (dict(result="ok"), summary["lectures_ok"]),
+                (dict(result="failed"), summary["lectures_failed"]),
+            ],
+        )
+        metric(
+            "echo360_download_last_run_timestamp_seconds",
+            "gauge",
+            "Unix time the last run started.",
+            [({}, self.started)],
+        )
+        _write_atomic(path, "\n".join(lines) + "\n")
+
+
+def _histogram_samples(name, labels, histogram):
+    samples = []
+    cumulative = 0
+    bounds = [_number(b) for b in histogram.buckets] + ["+Inf"]
+    for bound, count in zip(bounds, histogram.counts):
+        cumulative += count
+        samples.append(
+            "{}_bucket{} {}".format(name, _labels(dict(labels, le=bound)), cumulative)
+        )
+    samples.append("{}_sum{} {}".format(name, _labels(labels), _number(histogram.sum)))
+    samples.append("{}_count{} {}".format(name, _labels(labels), histogram.count))
+    return samples
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    return "{{{}}}".format(
+        ",".join(
+            '{}="{}"'.format(
+                key,
+                str(value)
+                .replace("\\", "\\\\")
+                .replace('"', '\\"')
+                .replace("\n", "\\n"),
+            )
+            for key, value in labels.items()
+        )
+    )
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _write_atomic(path, text):
+    # the textfile collector may read at any moment, never let it see half a file
+    tmp_path = "{}.{}.tmp".format(path, os.getpid())
+    with open(tmp_path, "w") as f:
+        f.write(text)
+    os.replace(tmp_path, path)
@@ -0,0 +1,327 @@
+import contextlib
+import logging
+import os
+import time
+
+import gevent
+from gevent.pool import Pool
+import requests
+
+from .journal import DownloadJournal
+from .progress import get_progress_display
+from .retry import FATAL, RetryPolicy
+from .streaming import DEFAULT_CHUNK_SIZE, stream_to_file
+
+_LOGGER = logging.getLogger(__name__)
+
+# files smaller than this are not worth splitting into ranges
+MIN_RANGED_SIZE = 4 * 1024 * 1024
+DEFAULT_PART_SIZE = 8 * 1024 * 1024
+
+
+class RangesUnsupported(Exception):
+    pass
+
+
+def probe(session, url):
+    """
+    Return `(size, accepts_ranges)` for `url`.
+
+    Tries a HEAD request first and falls back to a one byte range request for servers
+    (e.g. presigned S3 urls) that only sign GET.
+    """
+    try:
+        r = session.head(url, allow_redirects=True, timeout=20)
+        size = int(r.headers.get("content-length", 0))
+        if r.ok and size:
+            return size, r.headers.get("accept-ranges", "").lower() == "bytes"
+    except requests.RequestException:
+        pass
+    r = session.get(url, headers={"Range": "bytes=0-0"}, stream=True, timeout=20)
+    r.close()
+    if r.status_code == 206 and "/" in r.headers.get("content-range", ""):
+        total = r.headers["content-range"].rsplit("/", 1)[1]
+        if total.isdigit():
+            return int(total), True
+    return int(r.headers.get("content-length", 0)), False
+
+
+def download_mp4(
+    session,
+    url,
+    path,
+    resume=True,
+    stats=None,
+    connections=8,
+    part_size=DEFAULT_PART_SIZE,
+    limiter=None,
+    retry_policy=None,
+    chunk_size=DEFAULT_CHUNK_SIZE,
+    metrics=None,
+    progress=None,
+):
+    """
+    Download a single mp4 file to `path`.
+
+    When the server reports a size and accepts byte ranges, the file is preallocated
+    and fetched as `part_size` ranges over `connections` concurrent requests, each
+    written at its own offset. Otherwise it is streamed over one connection.
+
+    Either way a journal next to `path` records what is on disk, so an interrupted
+    download continues where it stopped. A `metrics.LectureMetrics` given as `metrics`
+    is told about every range request. Progress goes to the `progress.ProgressDisplay`
+    given as `progress`, the shared one if None.
+    """
+    if progress is None:
+        progress = get_progress_display()
+    if connections > 1:
+        size, accepts_ranges = probe(session, url)
+        if accepts_ranges and size >= MIN_RANGED_SIZE:
+            try:
+                return _download_ranges(
+                    session,
+                    url,
+                    path,
+                    size,
+                    resume=resume,
+                    stats=stats,
+                    connections=connections,
+                    part_size=part_size,
+                    limiter=limiter,
+                    retry_policy=retry_policy or RetryPolicy(),
+                    chunk_size=chunk_size,
+                    metrics=metrics,
+                    progress=progress,
+                )
+            except RangesUnsupported:
+                _LOGGER.debug("Range requests not honoured for %s", url)
+    return _download_stream(
+        session,
+        url,
+        path,
+        resume=resume,
+        stats=stats,
+        chunk_size=chunk_size,
+        metrics=metrics,
+        progress=progress,
+    )
+
+
+def _observe(metrics, url, sent, nbytes=0, response=None, error=False):
+    if metrics is not None:
+        metrics.record_request(
+            url,
+            time.monotonic() - sent,
+            nbytes=nbytes,
+            status=response.status_code if response is not None else None,
+            ttfb=response.elapsed.total_seconds() if response is not None else None,
+            error=error,
+        )
+
+
+def _download_ranges(
+    session,
+    url,
+    path,
+    size,
+    resume,
+    stats,
+    connections,
+    part_size,
+    limiter,
+    retry_policy,
+    chunk_size,
+    metrics,
+    progress,
+):
+    journal = DownloadJournal.open(path, url, total=size) if resume else None
+    # bytes already on disk per part, keyed by the part's start offset
+    done = dict(journal.parts) if journal is not None else {}
+    if done and os.path.getsize(path) == size:
+        print(
+            "  > Resuming with {:.1f} MB on disk".format(
+                sum(done.values()) / 1024 / 1024
+            )
+        )
+    else:
+        done = {}
+        if journal is not None:
+            journal.reset()
+        with open(path, "wb") as f:
+            f.truncate(size)
+
+    parts = [
+        (start, min(start + part_size, size) - start)
+        for start in range(0, size, part_size)
+    ]
+    slot = limiter if limiter is not None else contextlib.nullcontext()
+
+    task = progress.task(
+        os.path.basename(path), nbytes=size, done_bytes=sum(done.values())
+    )
+
+    def fetch_part(part):
+        start, length = part
+
+        def on_progress(nbytes):
+            done[start] = done.get(start, 0) + nbytes
+            task.update(nbytes=nbytes)
+            if stats is not None:
+                stats.add(nbytes)
+            if journal is not None:
+                journal.record(start, done[start])
+                if journal.due():
+                    journal.save()
+
+        attempt = 0
+        # every request for this part, unlike `attempt` not reset by progress
+        requests_made = 0
+        while done.get(start, 0) < length:
+            attempt += 1
+            requests_made += 1
+            before = done.get(start, 0)
+            offset = start + before
+            headers = {"Range": "bytes={}-{}".format(offset, start + length - 1)}
+            r = None
+            try:
+                # unbuffered, so whatever the journal records is already written
+                with slot, open(path, "r+b", buffering=0) as f:
+                    sent = time.monotonic()
+                    try:
+                        r = session.get(url, headers=headers, stream=True, timeout=20)
+                        if r.status_code == 206:
+                            f.seek(offset)
+                            stream_to_file(
+                                r, f, chunk_size=chunk_size, on_progress=on_progress
+                            )
+                    except requests.RequestException:
+                        nbytes = done.get(start, 0) - before
+                        _observe(metrics, url, sent, nbytes, r, error=True)
+                        raise
+                    finally:
+                        # a 200 or error status leaves the body unread
+                        if r is not None:
+                            r.close()
+                    _observe(metrics, url, sent, done.get(start, 0) - before, r)
+                    if r.status_code == 200:
+                        raise RangesUnsupported()
+                    if done.get(start, 0) > before:
+                        # a short read that made progress, carry on from there
+                        attempt = 0
+                        continue
+                kind, reason = retry_policy.classify(response=r)
+            except requests.RequestException as e:
+                kind, reason = retry_policy.classify(exception=e)
+            if kind == FATAL or attempt >= retry_policy.max_attempts:
+                if metrics is not None:
+                    metrics.record_segment(url, requests_made, ok=False)
+                raise requests.HTTPError(
+                    "Range {} of {} failed: {}".format(headers["Range"], url, reason)
+                )
+            gevent.sleep(retry_policy.delay(attempt, r))
+        if metrics is not None:
+            metrics.record_segment(url, requests_made)
+
+    pool = Pool(connections)
+    completed = False
+    try:
+        for _ in pool.imap_unordered(fetch_part, parts):
+            pass
+        completed = True
+    finally:
+        pool.kill()
+        task.finish(ok=completed)
+        if journal is not None:
+            journal.save()
+    if journal is not None:
+        journal.remove()
+    return path
+
+
+def _download_stream(
+    session,
+    url,
+    path,
+    resume=True,
+    stats=None,
+    chunk_size=DEFAULT_CHUNK_SIZE,
+    metrics=None,
+    progress=None,
+):
+    if progress is None:
+        progress = get_progress_display()
+    journal = DownloadJournal.open(path, url) if resume else None
+    offset = 0
+    if journal is not None:
+        offset = journal.parts.get(0, 0)
+        if offset and offset > os.path.getsize(path):
+            offset = 0
+
+    while True:
+        headers = {"Range": "bytes={}-".format(offset)} if offset else {}
+        sent = time.monotonic()
+        try:
+            r = session.get(url, stream=True, headers=headers, timeout=20)
+        except requests.RequestException:
+            _observe(metrics, url, sent, error=True)
+            raise
+        if not offset or r.status_code != 416:
+            break
+        # nothing left after `offset`: a run that stopped between saving the journal
+        # and removing it, or a file that changed since
+        _observe(metrics, url, sent, response=r)
+        r.close()
+        if r.headers.get("content-range", "").rpartition("/")[2] == str(offset):
+            journal.remove()
+            return path
+        journal.reset()
+        offset = 0
+    if not r.ok:
+        _observe(metrics, url, sent, response=r)
+        r.close()
+    r.raise_for_status()
+    if offset and r.status_code != 206:
+        # range not honoured, the body is the whole file again
+        offset = 0
+    resumed_from = offset
+    if offset:
+        print("  > Resuming from {:.1f} MB".format(offset / 1024 / 1024))
+
+    total_size = offset + int(r.headers.get("content-length", 0))
+    task = progress.task(
+        os.path.basename(path), nbytes=total_size or None, done_bytes=offset
+    )
+    completed = False
+    with open(path, "r+b" if offset else "wb") as f:
+        f.seek(offset)
+        f.truncate()
+
+        def on_progress(nbytes):
+            nonlocal offset
+            offset += nbytes
+            task.update(nbytes=nbytes)
+            if stats is not None:
+                stats.add(nbytes)
+            if journal is not None:
+                journal.record(0, offset)
+                if journal.due():
+                    f.flush()
+                    journal.save()
+
+        try:
+            stream_to_file(r, f, chunk_size=chunk_size, on_progress=on_progress)
+            completed = True
+        except requests.RequestException:
+            _observe(metrics, url, sent, offset - resumed_from, r, error=True)
+            raise
+        else:
+            _observe(metrics, url, sent, offset - resumed_from, r)
+        finally:
+            r.close()
+            task.finish(ok=completed)
+            if journal is not None:
+                f.flush()
+                journal.save()
+    if journal is not None:
+        journal.remove()
+    return path
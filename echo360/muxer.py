@@ -0,0 +1,138 @@
+"""
+Mux media with ffmpeg while it is still being downloaded.
+
+Every input of the ffmpeg command is a named pipe. Downloaders write ordered segment
+bytes into the pipes as they arrive, so remuxing overlaps the download and no
+intermediate file is written. Needs `os.mkfifo`, i.e. a POSIX system.
+"""
+
+import errno
+import logging
+import os
+import shutil
+import tempfile
+
+import ffmpy
+import gevent
+import gevent.os
+
+_LOGGER = logging.getLogger(__name__)
+
+
+def stream_mux_supported():
+    return hasattr(os, "mkfifo")
+
+
+class PipeWriter:
+    """
+    Write end of a named pipe that never blocks the other greenlets.
+
+    The pipe is opened on the first write, once ffmpeg has opened it for reading;
+    a full pipe suspends only the writing greenlet until ffmpeg catches up.
+    """
+
+    def __init__(self, path, reader):
+        self.name = path
+        self._reader = reader
+        self._fd = None
+        self._opened = False
+        self.closed = False
+
+    def _open(self):
+        # several greenlets may write; only the first one opens the pipe
+        while self._fd is None:
+            try:
+                self._fd = os.open(self.name, os.O_WRONLY | os.O_NONBLOCK)
+                self._opened = True
+                return
+            except OSError as e:
+                # ENXIO: nobody has the pipe open for reading yet
+                if e.errno != errno.ENXIO:
+                    raise
+            if self._reader.dead:
+                raise BrokenPipeError(
+                    errno.EPIPE, "ffmpeg exited before reading", self.name
+                )
+            gevent.sleep(0.05)
+
+    def write(self, data):
+        if self.closed:
+            raise BrokenPipeError(errno.EPIPE, "Pipe already closed", self.name)
+        if self._fd is None:
+            self._open()
+        view = memoryview(data)
+        while view:
+            written = gevent.os.nb_write(self._fd, view)
+            view = view[written:]
+
+    def finish(self):
+        """Close the pipe so ffmpeg sees the end of the input, opening it if need be."""
+        if not self._opened:
+            self._open()
+        self.close()
+
+    def close(self):
+        if self._fd is not None:
+            # not os.close: gevent's patched version defers closing a pipe to the
+            # event loop, and ffmpeg would not see EOF until something else wakes it
+            os.closerange(self._fd, self._fd + 1)
+            self._fd = None
+        self.closed = True
+
+
+class StreamMuxer:
+    """
+    An ffmpeg process reading `input_count` named pipes into `output_path`.
+
+    Write each input through `writers[i]` and close it at its end, then call `wait`.
+    `abort` stops ffmpeg and removes the partial output.
+
+    Args:
+        output_path: file ffmpeg writes
+        input_count: number of inputs, in the order of `output_options` stream indices
+        output_options: ffmpeg options for the output, as for `ffmpy.FFmpeg`
+    """
+
+    def __init__(self, output_path, input_count, output_options):
+        self.output_path = output_path
+        self._dir = tempfile.mkdtemp(prefix="echo360-mux-")
+        paths = [
+            os.path.join(self._dir, "input{}".format(i)) for i in range(input_count)
+        ]
+        for path in paths:
+            os.mkfifo(path)
+        self._ff = ffmpy.FFmpeg(
+            global_options=["-y", "-loglevel", "error"],
+            inputs={path: None for path in paths},
+            outputs={output_path: output_options},
+        )
+        _LOGGER.debug("Streaming into %s", self._ff.cmd)
+        self._greenlet = gevent.spawn(self._ff.run)
+        self.writers = [PipeWriter(path, self._greenlet) for path in paths]
+
+    def wait(self):
+        """Signal end of input and wait for ffmpeg; raises `ffmpy.FFRuntimeError`."""
+        try:
+            for writer in self.writers:
+                try:
+                    writer.finish()
+                except BrokenPipeError:
+                    # ffmpeg is gone, its exit status tells why
+                    break
+            self._greenlet.get()
+        finally:
+            self._cleanup()
+
+    def abort(self):
+        for writer in self.writers:
+            writer.close()
+        process = getattr(self._ff, "process", None)
+        if process is not None and process.poll() is None:
+            process.kill()
+        self._greenlet.kill()
+        self._cleanup()
+        if os.path.exists(self.output_path):
+            os.remove(self.output_path)
+
+    def _cleanup(self):
+        shutil.rmtree(self._dir, ignore_errors=True)
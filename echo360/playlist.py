@@ -0,0 +1,289 @@
+"""
+Typed model of HLS playlists.
+
+`parse_playlist` walks the playlist once, line by line, and returns either a
+`MasterPlaylist` (variant streams and alternative renditions) or a `MediaPlaylist`
+(segments with their durations, init sections and byte ranges). Attribute lists such
+as `BANDWIDTH=1,CODECS="a,b"` are split by a single scan that keeps track of quotes,
+so the cost stays linear in the size of the playlist.
+"""
+
+
+def resolve_uri(base_url, uri):
+    """Resolve a playlist uri against the url of the playlist it appeared in."""
+    if base_url is None or "://" in uri:
+        return uri
+    # relative to the directory of the playlist, even with a leading slash
+    return base_url[: base_url.rfind("/") + 1] + uri.lstrip("/")
+
+
+def parse_attribute_list(text):
+    """Split `KEY=value,KEY="quoted, value"` into a dict, unquoting the values."""
+    attributes = {}
+    length = len(text)
+    i = 0
+    while i < length:
+        equals = text.find("=", i)
+        if equals == -1:
+            break
+        key = text[i:equals].strip()
+        i = equals + 1
+        if i < length and text[i] == '"':
+            end = text.find('"', i + 1)
+            if end == -1:
+                end = length
+            attributes[key] = text[i + 1 : end]
+            i = text.find(",", end)
+        else:
+            end = text.find(",", i)
+            if end == -1:
+                end = length
+            attributes[key] = text[i:end].strip()
+            i = end
+        if i == -1:
+            break
+        i += 1
+    return attributes
+
+
+def _parse_byterange(value, previous_end):
+    """Return (offset, length) for `length[@offset]`."""
+    length, _, offset = value.partition("@")
+    length = int(length)
+    offset = int(offset) if offset else previous_end
+    return offset, length
+
+
+class Variant:
+    """An `EXT-X-STREAM-INF` entry of a master playlist."""
+
+    def __init__(self, uri, attributes):
+        self.uri = uri
+        self.attributes = attributes
+        self.bandwidth = int(attributes.get("BANDWIDTH", 0))
+        self.resolution = attributes.get("RESOLUTION")
+        self.codecs = attributes.get("CODECS")
+        self.audio = attributes.get("AUDIO")
+
+    @property
+    def has_video(self):
+        return self.resolution is not None
+
+    def __repr__(self):
+        return "Variant({!r}, bandwidth={})".format(self.uri, self.bandwidth)
+
+
+class Rendition:
+    """An `EXT-X-MEDIA` entry of a master playlist."""
+
+    def __init__(self, attributes, uri=None):
+        self.attributes = attributes
+        self.uri = uri
+        self.type = attributes.get("TYPE")
+        self.group_id = attributes.get("GROUP-ID")
+        self.name = attributes.get("NAME")
+        self.default = attributes.get("DEFAULT") == "YES"
+
+    def __repr__(self):
+        return "Rendition({!r}, type={}, group={})".format(
+            self.uri, self.type, self.group_id
+        )
+
+
+class InitSection:
+    """An `EXT-X-MAP` media initialization section."""
+
+    def __init__(self, uri, byterange=None):
+        self.uri = uri
+        self.byterange = byterange
+
+    def __eq__(self, other):
+        return (
+            isinstance(other, InitSection)
+            and self.uri == other.uri
+            and self.byterange == other.byterange
+        )
+
+    def __repr__(self):
+        return "InitSection({!r}, byterange={})".format(self.uri, self.byterange)
+
+
+class Segment:
+    """A media segment. `byterange` is `(offset, length)` or None."""
+
+    # long lectures have tens of thousands of these
+    __slots__ = ("uri", "duration", "title", "byterange", "init_section")
+
+    def __init__(self, uri, duration, title="", byterange=None, init_section=None):
+        self.uri = uri
+        self.duration = duration
+        self.title = title
+        self.byterange = byterange
+        self.init_section = init_section
+
+    def __repr__(self):
+        return "Segment({!r}, duration={})".format(self.uri, self.duration)
+
+
+class MasterPlaylist:
+    def __init__(self, variants, renditions, version=None):
+        self.variants = variants
+        self.renditions = renditions
+        self.version = version
+
+    def best_variant(self, video_only=False):
+        """Highest bandwidth variant, the later one on a tie."""
+        candidates = [v for v in self.variants if v.has_video] if video_only else []
+        candidates = candidates or self.variants
+        if not candidates:
+            return None
+        best = candidates[0]
+        for variant in candidates[1:]:
+            if variant.bandwidth >= best.bandwidth:
+                best = variant
+        return best
+
+    def audio_for(self, variant):
+        """Uri of the separate audio playlist that goes with `variant`, if any."""
+        if variant.audio is None:
+            return None
+        renditions = [
+            r
+            for r in self.renditions
+            if r.type == "AUDIO" and r.group_id == variant.audio and r.uri
+        ]
+        renditions.sort(key=lambda r: not r.default)
+        if renditions:
+            return renditions[0].uri
+        # older playlists list the audio track as an audio-only variant instead
+        for other in self.variants:
+            if not other.has_video and other.audio == variant.audio:
+                return other.uri
+        return None
+
+    def video_and_audio(self):
+        """Return `(video_uri, audio_uri)` of the best video variant."""
+        video = self.best_variant(video_only=True)
+        if video is None:
+            return None, None
+        return video.uri, self.audio_for(video)
+
+
+class MediaPlaylist:
+    def __init__(
+        self,
+        segments,
+        target_duration=None,
+        media_sequence=0,
+        version=None,
+        endlist=False,
+    ):
+        self.segments = segments
+        self.target_duration = target_duration
+        self.media_sequence = media_sequence
+        self.version = version
+        self.endlist = endlist
+
+    @property
+    def duration(self):
+        return sum(segment.duration for segment in self.segments)
+
+
+def parse_playlist(text, base_url=None):
+    """
+    Parse an m3u8 playlist into a `MasterPlaylist` or a `MediaPlaylist`.
+
+    Uris are resolved against `base_url` when given.
+
+    Raises:
+        ValueError: when the text is not an m3u8 playlist
+    """
+    if isinstance(text, bytes):
+        text = text.decode("utf-8-sig")
+    lines = text.splitlines()
+    if not lines or lines[0].lstrip("\ufeff").strip() != "#EXTM3U":
+        raise ValueError("Invalid m3u8 format")
+
+    version = None
+    variants = []
+    renditions = []
+    segments = []
+    target_duration = None
+    media_sequence = 0
+    endlist = False
+    is_master = False
+
+    pending_variant = None
+    duration = None
+    title = ""
+    byterange = None
+    previous_end = 0
+    init_section = None
+
+    for line in lines[1:]:
+        line = line.strip()
+        if not line:
+            continue
+        if line[0] != "#":
+            uri = resolve_uri(base_url, line)
+            if pending_variant is not None:
+                variants.append(Variant(uri, pending_variant))
+                pending_variant = None
+            else:
+                segments.append(
+                    Segment(
+                        uri,
+                        duration or 0.0,
+                        title,
+                        byterange,
+                        init_section,
+                    )
+                )
+                if byterange is not None:
+                    previous_end = byterange[0] + byterange[1]
+                duration = None
+                title = ""
+                byterange = None
+            continue
+        if not line.startswith("#EXT"):
+            # a plain comment
+            continue
+
+        tag, _, value = line.partition(":")
+        if tag == "#EXTINF":
+            length, _, title = value.partition(",")
+            duration = float(length)
+        elif tag == "#EXT-X-BYTERANGE":
+            byterange = _parse_byterange(value, previous_end)
+        elif tag == "#EXT-X-MAP":
+            attributes = parse_attribute_list(value)
+            map_range = None
+            if "BYTERANGE" in attributes:
+                map_range = _parse_byterange(attributes["BYTERANGE"], 0)
+            init_section = InitSection(
+                resolve_uri(base_url, attributes["URI"]), map_range
+            )
+        elif tag == "#EXT-X-STREAM-INF":
+            is_master = True
+            pending_variant = parse_attribute_list(value)
+        elif tag == "#EXT-X-MEDIA":
+            is_master = True
+            attributes = parse_attribute_list(value)
+            uri = attributes.get("URI")
+            renditions.append(
+                Rendition(
+                    attributes, resolve_uri(base_url, uri) if uri is not None else None
+                )
+            )
+        elif tag == "#EXT-X-TARGETDURATION":
+            target_duration = int(value)
+        elif tag == "#EXT-X-MEDIA-SEQUENCE":
+            media_sequence = int(value)
+        elif tag == "#EXT-X-VERSION":
+            version = int(value)
+        elif tag == "#EXT-X-ENDLIST":
+            endlist = True
+
+    if is_master:
+        return MasterPlaylist(variants, renditions, version)
+    return MediaPlaylist(segments, target_duration, media_sequence, version, endlist)
@@ -0,0 +1,86 @@
+"""
+Run the ffmpeg step of finished downloads in the background.
+
+Muxing a lecture keeps ffmpeg busy while the network sits idle, and downloading the
+next one keeps the network busy while ffmpeg has nothing to do. `PostProcessor`
+takes the ffmpeg work off the download path, so the two overlap.
+"""
+
+import logging
+
+import gevent
+from gevent.lock import BoundedSemaphore
+
+_LOGGER = logging.getLogger(__name__)
+
+
+def run_ffmpeg(ff):
+    """
+    Run an `ffmpy.FFmpeg` command.
+
+    If the calling greenlet is interrupted, e.g. by a timeout, the ffmpeg process is
+    killed too instead of being left running in the background.
+    """
+    try:
+        return ff.run()
+    except BaseException:
+        process = getattr(ff, "process", None)
+        if process is not None and process.poll() is None:
+            process.kill()
+            process.wait()
+        raise
+
+
+class PostProcessor:
+    """
+    A bounded pool of post-processing jobs, e.g. muxing the tracks of a lecture.
+
+    `submit` returns straight away; at most `workers` jobs run at once and the rest
+    wait their turn. A job that raises or runs longer than `timeout` seconds is
+    reported and counts as failed, the other jobs and the run carry on.
+
+    Args:
+        workers: number of jobs (i.e. ffmpeg processes) running at the same time
+        timeout: seconds a single job may take, None for no limit
+    """
+
+    def __init__(self, workers=1, timeout=None):
+        self.timeout = timeout
+        self._slots = BoundedSemaphore(workers)
+        self._jobs = []
+
+    def submit(self, name, job):
+        """
+        Run `job()` once a worker is free; return the greenlet running it.
+
+        The greenlet's value is True when the job returned a true value, False when
+        it failed or timed out.
+        """
+        greenlet = gevent.spawn(self._run, name, job)
+        self._jobs.append(greenlet)
+        return greenlet
+
+    def _run(self, name, job):
+        with self._slots:
+            _LOGGER.debug("Post-processing %s", name)
+            try:
+                with gevent.Timeout(self.timeout):
+                    return bool(job())
+            except gevent.Timeout:
+                print(
+                    'ERROR: post-processing of "{}" took longer than {}s'.format(
+                        name, self.timeout
+                    )
+                )
+            except Exception as e:
+                _LOGGER.debug("Post-processing of %s failed", name, exc_info=True)
+                print('ERROR: post-processing of "{}" failed: {}'.format(name, e))
+            return False
+
+    @property
+    def pending(self):
+        return sum(1 for job in self._jobs if not job.ready())
+
+    def join(self):
+        """Wait for every submitted job to finish."""
+        gevent.joinall(self._jobs)
@@ -0,0 +1,239 @@
+"""
+One progress display for every download of the run.
+
+Downloads only bump counters on their `ProgressTask`, which costs next to nothing
+however many segments complete per second. On a terminal a single status line with
+the totals of all active downloads is redrawn every `interval` seconds; anywhere else
+(a log file, a pipe) nothing is redrawn and each download start and finish is written
+as a line of its own instead.
+"""
+
+import shutil
+import sys
+import time
+
+import gevent
+
+DEFAULT_INTERVAL = 0.5
+_BAR_LENGTH = 20
+
+
+class ProgressTask:
+    """
+    Counters of one download, e.g. one track of a lecture.
+
+    Call `update` as segments or bytes arrive and `finish` once the download is over.
+    Either total may be None when it is not known up front.
+    """
+
+    def __init__(
+        self, display, name, segments=None, nbytes=None, done_segments=0, done_bytes=0
+    ):
+        self.name = name
+        self.segments_total = segments
+        self.bytes_total = nbytes
+        # what was already on disk when a download resumed
+        self.segments = done_segments
+        self.bytes = done_bytes
+        self.failed = 0
+        self.started = time.monotonic()
+        self._display = display
+
+    def update(self, nbytes=0, segments=0, failed=0):
+        self.bytes += nbytes
+        self.segments += segments
+        self.failed += failed
+        self._display.bytes += nbytes
+
+    def finish(self, ok=True):
+        self._display.finish(self, ok)
+
+
+class _StatusLineStream:
+    """
+    Stands in for `sys.stdout` while a status line is on screen.
+
+    Everything else printed during the downloads goes through here, so the status
+    line is cleared first instead of ending up in the middle of the text.
+    """
+
+    def __init__(self, display, stream):
+        self._display = display
+        self._stream = stream
+
+    def write(self, text):
+        if text:
+            self._display.clear()
+            self._display.at_line_start = text.endswith("\n")
+        return self._stream.write(text)
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+
+class ProgressDisplay:
+    """
+    Aggregated progress of all active downloads.
+
+    Register each download with `task`. The display starts drawing with the first
+    task and stops once none is left.
+
+    Args:
+        interval: seconds between redraws of the status line
+        stream: where to write, `sys.stdout` at the time the first task starts if None
+        tty: force the status line (True) or the line per event mode (False), decided
+            by `stream.isatty()` if None
+    """
+
+    def __init__(self, interval=DEFAULT_INTERVAL, stream=None, tty=None):
+        self.interval = interval
+        self.stream = stream
+        self.tty = tty
+        # bytes of every task so far, finished ones included, for the speed
+        self.bytes = 0
+        self.at_line_start = True
+        self._tasks = []
+        self._out = None
+        self._interactive = False
+        self._drawn = False
+        self._greenlet = None
+        self._rate = None
+        self._last_sample = None
+
+    def task(self, name, segments=None, nbytes=None, done_segments=0, done_bytes=0):
+        """Register a download and return its `ProgressTask`."""
+        if not self._tasks:
+            self._start()
+        task = ProgressTask(self, name, segments, nbytes, done_segments, done_bytes)
+        self._tasks.append(task)
+        if not self._interactive:
+            total = ""
+            if segments is not None:
+                total = " ({} segments)".format(segments)
+            elif nbytes is not None:
+                total = " ({:.1f} MB)".format(nbytes / 1024 / 1024)
+            self._emit("  > {}: started{}".format(name, total))
+        return task
+
+    def finish(self, task, ok=True):
+        if task not in self._tasks:
+            return
+        self._tasks.remove(task)
+        elapsed = max(time.monotonic() - task.started, 1e-6)
+        megabytes = task.bytes / 1024 / 1024
+        if task.segments_total is not None:
+            done = "{}/{} segments, ".format(task.segments, task.segments_total)
+        else:
+            done = ""
+        self._emit(
+            "  > {}: {} ({}{:.1f} MB in {:.1f}s, {:.2f} MB/s{})".format(
+                task.name,
+                "done" if ok else "FAILED",
+                done,
+                megabytes,
+                elapsed,
+                megabytes / elapsed,
+                ", {} failed".format(task.failed) if task.failed else "",
+            )
+        )
+        if not self._tasks:
+            self._stop()
+
+    def _start(self):
+        self._out = self.stream if self.stream is not None else sys.stdout
+        tty = self.tty
+        if tty is None:
+            isatty = getattr(self._out, "isatty", None)
+            tty = bool(isatty and isatty())
+        self._interactive = tty
+        self._rate = None
+        self._last_sample = (time.monotonic(), self.bytes)
+        if self._interactive:
+            if sys.stdout is self._out:
+                sys.stdout = _StatusLineStream(self, self._out)
+            self._greenlet = gevent.spawn(self._redraw)
+
+    def _stop(self):
+        if self._greenlet is not None:
+            self._greenlet.kill()
+            self._greenlet = None
+        self.clear()
+        if isinstance(sys.stdout, _StatusLineStream) and sys.stdout._display is self:
+            sys.stdout = self._out
+
+    def _redraw(self):
+        while True:
+            gevent.sleep(self.interval)
+            self.draw()
+
+    def _emit(self, line):
+        # a line of its own; on a terminal it scrolls up above the status line
+        self.clear()
+        if not self.at_line_start:
+            self._out.write("\n")
+        self._out.write(line + "\n")
+        self._out.flush()
+        self.at_line_start = True
+
+    def clear(self):
+        if self._drawn:
+            self._out.write("\r\x1b[K")
+            self._drawn = False
+
+    def draw(self):
+        if not self._tasks:
+            return
+        if not self.at_line_start:
+            # someone left a line unfinished, e.g. "Converting to mp4... "
+            self._out.write("\n")
+            self.at_line_start = True
+        width = shutil.get_terminal_size().columns - 1
+        self._out.write("\r" + self.status_line()[:width] + "\x1b[K")
+        self._out.flush()
+        self._drawn = True
+
+    def status_line(self):
+        tasks = self._tasks
+        parts = []
+        fraction = None
+        if all(t.segments_total for t in tasks):
+            done = sum(t.segments for t in tasks)
+            total = sum(t.segments_total for t in tasks)
+            fraction = done / total
+        elif all(t.bytes_total for t in tasks):
+            fraction = sum(t.bytes for t in tasks) / sum(t.bytes_total for t in tasks)
+        if fraction is not None:
+            # the bar goes first, a narrow terminal cuts the line from the right
+            fraction = min(max(fraction, 0.0), 1.0)
+            block = "=" * int(round(_BAR_LENGTH * fraction))
+            if len(block) < _BAR_LENGTH:
+                block += ">"
+            parts.append(
+                "[{}] {:.1f}%".format(block.ljust(_BAR_LENGTH), fraction * 100)
+            )
+        parts.append("{} download{}".format(len(tasks), "s" if len(tasks) > 1 else ""))
+        if all(t.segments_total for t in tasks):
+            parts.append("{}/{} segments".format(done, total))
+        parts.append("{:.1f} MB".format(sum(t.bytes for t in tasks) / 1024 / 1024))
+        parts.append("{:.2f} MB/s".format(self._sample_rate() / 1024 / 1024))
+        failed = sum(t.failed for t in tasks)
+        if failed:
+            parts.append("{} failed".format(failed))
+        return "  > " + " | ".join(parts)
+
+    def _sample_rate(self):
+        now = time.monotonic()
+        then, nbytes = self._last_sample
+        self._last_sample = (now, self.bytes)
+        rate = (self.bytes - nbytes) / max(now - then, 1e-6)
+        # smooth over a few redraws, segments arrive in bursts
+        self._rate = rate if self._rate is None else 0.7 * self._rate + 0.3 * rate
+        return self._rate
+
+
+_DISPLAY = ProgressDisplay()
+
+
+def get_progress_display():
+    """Return the display shared by the whole process."""
+    return _DISPLAY
@@ -0,0 +1,99 @@
+import random
+import time
+from email.utils import parsedate_to_datetime
+
+import requests
+
+TRANSIENT = "transient"
+FATAL = "fatal"
+
+# statuses worth another try: rate limiting, timeouts and server side trouble
+_TRANSIENT_STATUSES = {408, 425, 429}
+
+
+class RetryBudget:
+    """Total number of retries one lecture may spend across all of its segments."""
+
+    def __init__(self, retries):
+        self.remaining = retries
+
+    def spend(self):
+        if self.remaining <= 0:
+            return False
+        self.remaining -= 1
+        return True
+
+
+class RetryPolicy:
+    """
+    Decide whether a failed request is worth retrying, and how long to wait first.
+
+    Timeouts, connection errors, 429 and 5xx responses are transient and retried with
+    exponential backoff plus jitter, honouring `Retry-After` when the server sends
+    one. Everything else, notably 401/403/404, is fatal and fails the segment at once.
+    """
+
+    def __init__(
+        self,
+        max_attempts=5,
+        base_delay=0.5,
+        max_delay=30.0,
+        jitter=0.5,
+        budget=200,
+        max_retry_after=120.0,
+    ):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.budget = budget
+        self.max_retry_after = max_retry_after
+
+    def new_budget(self):
+        return RetryBudget(self.budget)
+
+    @staticmethod
+    def classify(response=None, exception=None):
+        """Return `(TRANSIENT or FATAL, reason)` for a failed attempt."""
+        if exception is not None:
+            if isinstance(
+                exception,
+                (
+                    requests.Timeout,
+                    requests.ConnectionError,
+                    requests.exceptions.ChunkedEncodingError,
+                    requests.exceptions.ContentDecodingError,
+                ),
+            ):
+                return TRANSIENT, "{}: {}".format(type(exception).__name__, exception)
+            return FATAL, "{}: {}".format(type(exception).__name__, exception)
+        status = response.status_code
+        reason = "HTTP {} {}".format(status, response.reason or "").strip()
+        if status >= 500 or status in _TRANSIENT_STATUSES:
+            return TRANSIENT, reason
+        return FATAL, reason
+
+    def delay(self, attempt, response=None):
+        """Seconds to wait before attempt number `attempt + 1`."""
+        backoff = min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+        backoff *= 1 + random.uniform(-self.jitter, self.jitter)
+        retry_after = self._retry_after(response)
+        if retry_after is not None:
+            backoff = max(backoff, min(retry_after, self.max_retry_after))
+        return max(backoff, 0.0)
+
+    @staticmethod
+    def _retry_after(response):
+        if response is None:
+            return None
+        value = response.headers.get("Retry-After")
+        if not value:
+            return None
+        try:
+            return float(value)
+        except ValueError:
+            pass
+        try:
+            return parsedate_to_datetime(value).timestamp() - time.time()
+        except (TypeError, ValueError):
+            return None
@@ -0,0 +1,183 @@
+import logging
+import time
+
+from gevent.event import Event
+from gevent.pool import Pool
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class RequestLimiter:
+    """
+    Cap on in-flight segment requests, shared by every Downloader of a run.
+
+    Used as a context manager around each request. `record` receives the outcome of
+    every request; this fixed-size limiter ignores it.
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.in_flight = 0
+        self._slot_freed = Event()
+
+    def acquire(self):
+        while self.in_flight >= self.limit:
+            self._slot_freed.clear()
+            self._slot_freed.wait()
+        self.in_flight += 1
+
+    def release(self):
+        self.in_flight -= 1
+        self._slot_freed.set()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+    def record(self, latency, nbytes=0, status=None, error=False):
+        pass
+
+
+class AdaptiveLimiter(RequestLimiter):
+    """
+    Request limiter that tunes its own limit AIMD-style between `floor` and `ceiling`.
+
+    Completed requests are grouped into windows of `limit` requests. After a clean
+    window the limit grows by one, unless throughput dropped compared to the previous
+    window or latency climbed past `latency_tolerance` times the best window seen so
+    far (requests are queueing somewhere), in which case it stays or shrinks by one.
+    A 429, a 5xx or a connection error halves the limit straight away; errors from
+    requests that were already in flight at that point are not counted again.
+    """
+
+    def __init__(self, floor=4, ceiling=50, initial=None, latency_tolerance=2.0):
+        if initial is None:
+            initial = min(ceiling, max(floor, 16))
+        super(AdaptiveLimiter, self).__init__(initial)
+        self.floor = floor
+        self.ceiling = ceiling
+        self.latency_tolerance = latency_tolerance
+        self._best_latency = None
+        self._last_throughput = None
+        self._cooldown = 0
+        self._start_window()
+
+    def _start_window(self):
+        self._window_started = time.monotonic()
+        self._window_count = 0
+        self._window_bytes = 0
+        self._window_latency = 0.0
+
+    def record(self, latency, nbytes=0, status=None, error=False):
+        if self._cooldown:
+            self._cooldown -= 1
+        if error or status == 429 or (status is not None and status >= 500):
+            if not self._cooldown:
+                reason = "HTTP {}".format(status) if status else "connection error"
+                self._set_limit(self.limit // 2, reason)
+                self._cooldown = self.in_flight
+                self._start_window()
+            return
+        self._window_count += 1
+        self._window_bytes += nbytes
+        self._window_latency += latency
+        if self._window_count >= self.limit:
+            self._end_window()
+
+    def _end_window(self):
+        elapsed = max(time.monotonic() - self._window_started, 1e-6)
+        throughput = self._window_bytes / elapsed
+        latency = self._window_latency / self._window_count
+        if self._best_latency is None or latency < self._best_latency:
+            self._best_latency = latency
+
+        if latency > self._best_latency * self.latency_tolerance:
+            self._set_limit(
+                self.limit - 1,
+                "latency {:.2f}s vs best {:.2f}s".format(latency, self._best_latency),
+            )
+        elif self._last_throughput is None or throughput >= 0.9 * self._last_throughput:
+            self._set_limit(
+                self.limit + 1,
+                "{:.2f} MB/s at {:.2f}s latency".format(
+                    throughput / 1024 / 1024, latency
+                ),
+            )
+        self._last_throughput = throughput
+        self._start_window()
+
+    def _set_limit(self, limit, reason):
+        limit = max(self.floor, min(self.ceiling, limit))
+        if limit == self.limit:
+            return
+        _LOGGER.info("Concurrency %d -> %d (%s)", self.limit, limit, reason)
+        self.limit = limit
+        # let waiters re-check against the new limit
+        self._slot_freed.set()
+
+
+class TransferStats:
+    """Byte counter shared by every download of a run, for aggregate throughput."""
+
+    def __init__(self):
+        self.bytes = 0
+        self.started = time.monotonic()
+
+    def add(self, nbytes):
+        self.bytes += nbytes
+
+    @property
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    def summary(self):
+        megabytes = self.bytes / 1024 / 1024
+        elapsed = max(self.elapsed, 1e-6)
+        return "Downloaded {:.1f} MB in {:.1f}s ({:.2f} MB/s)".format(
+            megabytes, elapsed, megabytes / elapsed
+        )
+
+
+class LectureScheduler:
+    """
+    Download several lectures at once under one cap on in-flight segment requests.
+
+    Lectures are started in the order they are given, so the caller's ordering acts
+    as the priority: with `concurrent_lectures` slots, the first lectures get going
+    straight away and later ones take over each slot as soon as it frees up. All
+    segment requests of all lectures share `limiter`, so the total number of requests
+    on the wire never exceeds `max_requests` however many lectures are running.
+    With `adaptive`, the cap itself moves between `min_requests` and `max_requests`
+    depending on how the server copes.
+    """
+
+    def __init__(
+        self, concurrent_lectures=1, max_requests=50, adaptive=False, min_requests=4
+    ):
+        self.concurrent_lectures = concurrent_lectures
+        self.max_requests = max_requests
+        if adaptive:
+            self.limiter = AdaptiveLimiter(floor=min_requests, ceiling=max_requests)
+        else:
+            self.limiter = RequestLimiter(max_requests)
+        self.stats = TransferStats()
+
+    @property
+    def downloader_kwargs(self):
+        """Options to hand to every hls_downloader.Downloader of this run."""
+        return dict(limiter=self.limiter, stats=self.stats)
+
+    def run(self, jobs, download):
+        """
+        Call `download(*job)` for every job and return the results in job order.
+
+        Args:
+            jobs (list): argument tuples, highest priority first
+            download (callable): performs a single lecture download
+        """
+        self.stats.started = time.monotonic()
+        pool = Pool(self.concurrent_lectures)
+        return list(pool.imap(lambda job: download(*job), jobs))
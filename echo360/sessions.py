@@ -0,0 +1,124 @@
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class SessionRegistry:
+    """
+    Process-wide `requests.Session` objects, one per host.
+
+    Every lecture, track and course lookup that talks to the same host goes through the
+    same session and therefore the same urllib3 connection pool, so TCP and TLS
+    handshakes are paid once per connection rather than once per download. The pools
+    are sized to the run's request budget and the browser cookies are loaded once
+    after login.
+    """
+
+    def __init__(self, pool_maxsize=50, max_retries=0):
+        self.pool_maxsize = pool_maxsize
+        # retries belong to `RetryPolicy`, with its backoff and per-lecture budget;
+        # adapter retries underneath would repeat a failed request at once
+        self.max_retries = max_retries
+        self._cookies = []
+        self._sessions = {}
+
+    def configure(self, pool_maxsize=None, max_retries=None):
+        """Change pool sizing. Only affects sessions created afterwards."""
+        if pool_maxsize is not None:
+            self.pool_maxsize = pool_maxsize
+        if max_retries is not None:
+            self.max_retries = max_retries
+
+    def load_cookies(self, selenium_cookies):
+        """Copy the logged-in browser cookies into every current and future session."""
+        self._cookies = list(selenium_cookies)
+        for session in self._sessions.values():
+            self._apply_cookies(session)
+
+    @property
+    def has_cookies(self):
+        return bool(self._cookies)
+
+    def get(self, url):
+        """Return the shared session for the host of `url`."""
+        host = urlsplit(url).netloc
+        session = self._sessions.get(host)
+        if session is None:
+            session = self._new_session()
+            self._sessions[host] = session
+        return session
+
+    def _new_session(self):
+        session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=self.pool_maxsize,
+            pool_maxsize=self.pool_maxsize,
+            max_retries=self.max_retries,
+        )
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        self._apply_cookies(session)
+        return session
+
+    def _apply_cookies(self, session):
+        for cookie in self._cookies:
+            session.cookies.set(cookie["name"], cookie["value"])
+
+    def stats(self):
+        """
+        Return connection reuse counters per host.
+
+        `connections` is the number of connections opened, `requests` the number of
+        requests sent over them; everything beyond the first request on a connection
+        counts as `reused`.
+        """
+        stats = {}
+        for host, session in self._sessions.items():
+            requests_sent = 0
+            connections = 0
+            for adapter in set(session.adapters.values()):
+                pools = adapter.poolmanager.pools
+                for key in pools.keys():
+                    pool = pools.get(key)
+                    if pool is None:
+                        continue
+                    requests_sent += pool.num_requests
+                    connections += pool.num_connections
+            stats[host] = dict(
+                requests=requests_sent,
+                connections=connections,
+                reused=max(requests_sent - connections, 0),
+            )
+        return stats
+
+    def summary(self):
+        lines = []
+        for host, counters in sorted(self.stats().items()):
+            lines.append(
+                "{}: {} requests over {} connections ({} reused)".format(
+                    host,
+                    counters["requests"],
+                    counters["connections"],
+                    counters["reused"],
+                )
+            )
+        return "\n".join(lines)
+
+    def close(self):
+        for session in self._sessions.values():
+            session.close()
+        self._sessions = {}
+
+
+_REGISTRY = SessionRegistry()
+
+
+def get_session_registry():
+    """Return the registry shared by the whole process."""
+    return _REGISTRY
+
+
+def get_session(url):
+    """Shortcut for `get_session_registry().get(url)`."""
+    return _REGISTRY.get(url)
@@ -0,0 +1,78 @@
+"""
+Low-copy helpers for writing streamed response bodies to disk.
+
+`Response.iter_content` allocates a new bytes object for every chunk, and callers in
+this package used to update a progress bar for each 1 KB of it. These helpers read
+large chunks into one reusable buffer instead and report progress in batches.
+"""
+
+import time
+
+import requests
+from urllib3.exceptions import DecodeError, ProtocolError, ReadTimeoutError
+
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+DEFAULT_PROGRESS_INTERVAL = 0.25
+
+
+def iter_readinto(
+    response,
+    chunk_size=DEFAULT_CHUNK_SIZE,
+    on_progress=None,
+    progress_interval=DEFAULT_PROGRESS_INTERVAL,
+    buffer=None,
+):
+    """
+    Yield the body of a streamed `requests` response as memoryview slices.
+
+    The body is read with `readinto` into one preallocated buffer that is reused for
+    every chunk, so each yielded slice is only valid until the next one is requested;
+    write it out or copy it before moving on. `on_progress(nbytes)` is called at most
+    every `progress_interval` seconds with the bytes read since the previous call,
+    plus once at the end.
+    """
+    raw = response.raw
+    # requests leaves decoding to iter_content, do it here instead
+    raw.decode_content = True
+    if buffer is None:
+        buffer = bytearray(chunk_size)
+    view = memoryview(buffer)
+    pending = 0
+    last_report = time.monotonic()
+    try:
+        while True:
+            n = _readinto(raw, view)
+            if not n:
+                break
+            yield view[:n]
+            if on_progress is not None:
+                pending += n
+                now = time.monotonic()
+                if now - last_report >= progress_interval:
+                    on_progress(pending)
+                    pending = 0
+                    last_report = now
+    finally:
+        if on_progress is not None and pending:
+            on_progress(pending)
+
+
+def _readinto(raw, view):
+    # raise what iter_content would, so retry classification keeps working
+    try:
+        return raw.readinto(view)
+    except ProtocolError as e:
+        raise requests.exceptions.ChunkedEncodingError(e)
+    except DecodeError as e:
+        raise requests.exceptions.ContentDecodingError(e)
+    except ReadTimeoutError as e:
+        raise requests.ConnectionError(e)
+
+
+def stream_to_file(response, f, **kwargs):
+    """Write the body of `response` to the open file `f`; return the byte count."""
+    total = 0
+    for chunk in iter_readinto(response, **kwargs):
+        f.write(chunk)
+        total += len(chunk)
+    return total
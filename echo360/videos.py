@@ -2,11 +2,14 @@ import os
 import re
 
 import dateutil.parser
+import functools
 import operator
 import sys
-import tqdm
 
 import ffmpy
+import gevent
+import gevent.lock
+from gevent.pool import Pool
 import requests
 import selenium
 import logging
@@ -17,12 +20,65 @@ from selenium.webdriver.support import expected_conditions as EC
 from urllib.parse import urlparse
 from selenium.common.exceptions import StaleElementReferenceException, TimeoutException
 
+from .api import find_media_urls
+from .catalog import fingerprint
+from .echo_exceptions import EchoApiAuthError, HlsDownloaderError
 from .hls_downloader import Downloader
-from .naive_m3u8_parser import NaiveM3U8Parser
+from .mp4_downloader import download_mp4
+from .muxer import StreamMuxer, stream_mux_supported
+from .sessions import get_session
+from .streaming import DEFAULT_CHUNK_SIZE, stream_to_file
+from .playlist import MasterPlaylist, parse_playlist
+from .postprocess import run_ffmpeg
+from .progress import get_progress_display
 
 _LOGGER = logging.getLogger(__name__)
 
 
+# lectures are resolved concurrently but there is only one browser tab
+BROWSER_LOCK = gevent.lock.RLock()
+
+DEFAULT_RESOLVE_WORKERS = 8
+
+# how lectures with several video feeds (e.g. camera and screen) are saved:
+# side by side in one re-encoded video, as tracks of one file, or one file per feed
+FEED_MODES = ("hstack", "tracks", "separate")
+
+# RFC 6381 tags (the part before the first dot) of audio an mp4 file can carry as is
+MP4_AUDIO_CODECS = ("mp4a", "ac-3", "ec-3", "opus", "flac", "alac")
+_VIDEO_CODECS = ("avc1", "avc3", "hvc1", "hev1", "vp08", "vp09", "av01", "dvh1", "dvhe")
+# what "copy" falls back to when the source audio cannot go into mp4 untouched
+FALLBACK_AUDIO_CODEC = "aac"
+
+
+def audio_fits_mp4(codecs):
+    """
+    Whether the audio listed in an HLS `CODECS` attribute can be stream copied to mp4.
+
+    Returns None when `codecs` is unknown or lists no audio at all.
+    """
+    if not codecs:
+        return None
+    tags = [tag.strip().split(".")[0].lower() for tag in codecs.split(",")]
+    audio = [tag for tag in tags if tag and tag not in _VIDEO_CODECS]
+    if not audio:
+        return None
+    return all(tag in MP4_AUDIO_CODECS for tag in audio)
+
+
+def choose_audio_codec(policy, codecs=None):
+    """
+    The ffmpeg `-c:a` value for an audio `policy`.
+
+    "copy" stream copies unless `codecs` says the source does not fit in mp4, in
+    which case it transcodes to `FALLBACK_AUDIO_CODEC`; any other policy is the name
+    of the encoder to transcode with.
+    """
+    if policy != "copy":
+        return policy
+    return "copy" if audio_fits_mp4(codecs) is not False else FALLBACK_AUDIO_CODEC
+
+
 class AllMethodsExhaustedError(Exception):
     pass
 
@@ -35,6 +91,30 @@ def update_course_retrieval_progress(current, total):
     sys.stdout.flush()
 
 
+def resolve_concurrently(items, resolve, workers=DEFAULT_RESOLVE_WORKERS, total=None):
+    """
+    Return `[resolve(item) for item in items]`, running up to `workers` at a time.
+
+    Lookups over HTTP overlap freely, the ones that need the browser take turns on
+    it. `items` may be a generator, it is consumed as the pool frees up; pass its
+    expected length as `total` for the course retrieval progress line.
+    """
+    if total is None:
+        total = len(items)
+    finished = 0
+    update_course_retrieval_progress(0, total)
+
+    def run(item):
+        nonlocal finished
+        try:
+            return resolve(item)
+        finally:
+            finished += 1
+            update_course_retrieval_progress(finished, total)
+
+    return list(Pool(max(workers, 1)).imap(run, items))
+
+
 def combine_videos_horizontally(*paths, output_path="output.mp4"):
     # Create a dictionary of input files, required by ffmpy
     # The key is the path to the video file, and the value is None (no specific options needed for input)
@@ -65,26 +145,41 @@ def combine_videos_horizontally(*paths, output_path="output.mp4"):
     output_options += " -c:a aac"
 
     ff = ffmpy.FFmpeg(
+        # quiet, ffmpeg may run in the background next to the progress display
+        global_options=["-y", "-loglevel", "error"],
         inputs=input_files,
         outputs={
             output_path: output_options,
         },
     )
-    ff.run()
+    run_ffmpeg(ff)
+
+
+def combine_videos_as_tracks(*paths, output_path="output.mkv"):
+    # Stream copy every video feed into its own track, no re-encoding at all.
+    # The audio of the first feed is kept, the other feeds carry the same audio.
+    output_options = []
+    for index in range(len(paths)):
+        output_options += ["-map", f"{index}:v"]
+    # `?` keeps ffmpeg from failing on a feed without audio
+    output_options += ["-map", "0:a?", "-c", "copy"]
+    ff = ffmpy.FFmpeg(
+        global_options=["-y", "-loglevel", "error"],
+        inputs={path: None for path in paths},
+        outputs={output_path: output_options},
+    )
+    run_ffmpeg(ff)
 
 
 class EchoVideos(object):
-    def __init__(self, videos_json, driver):
+    def __init__(self, videos_json, driver, api=None, catalog=None):
         assert videos_json is not None
         self._driver = driver
-        self._videos = []
-        total_videos_num = len(videos_json)
-        update_course_retrieval_progress(0, total_videos_num)
-
-        for i, video_json in enumerate(videos_json):
-            self._videos.append(EchoVideo(video_json, self._driver))
-            update_course_retrieval_progress(i + 1, total_videos_num)
-
+        # cheap, media urls are only resolved for the lectures that get downloaded
+        self._videos = [
+            EchoVideo(video_json, self._driver, api=api, catalog=catalog)
+            for video_json in videos_json
+        ]
         self._videos.sort(key=operator.attrgetter("date"))
 
     @property
@@ -98,21 +193,24 @@ class EchoVideos(object):
 
 
 class EchoVideo(object):
-    def __init__(self, video_json, driver):
+    # where the last successful download() put the lecture, one file per feed with
+    # the "separate" feed mode
+    output_paths = ()
+    # a lecture whose media cannot be found is skipped instead of ending the run
+    skip_on_error = False
+
+    def __init__(self, video_json, driver, api=None, catalog=None):
         self._driver = driver
+        self._api = api
+        self._catalog = catalog
+        self.video_json = video_json
+        self._resolved = False
+        self._url = None
 
         try:
             video_url = "{0}".format(video_json["richMedia"])
-            video_url = str(video_url)  # cast back to string
-
-            self._driver.get(video_url)
-            _LOGGER.debug(
-                "Dumping video page at %s: %s", video_url, self._driver.page_source
-            )
-
-            m3u8_url = self._loop_find_m3u8_url(video_url, waitsecond=30)
-            _LOGGER.debug("Found the following urls %s", m3u8_url)
-            self._url = m3u8_url
+            self.video_url = str(video_url)  # cast back to string
+            self._lesson_id = video_json.get("uuid") or self.video_url
 
             self._date = self.get_date(video_json["startTime"])
             self._title = video_json["title"]
@@ -120,41 +218,89 @@ class EchoVideo(object):
         except KeyError as e:
             self._blow_up("Unable to parse video data from JSON (course_data)", e)
 
+    def _resolve_url(self):
+        url = self._page_media_url(self.video_url)
+        if url is None:
+            url = self._loop_find_m3u8_url(self.video_url, waitsecond=30)
+        return url
+
+    def _cached_url(self):
+        """Resolve the media url, unless the catalog has it for this lesson JSON."""
+        if self._catalog is None:
+            return self._resolve_url()
+        lesson_fingerprint = fingerprint(self.video_json)
+        found, url = self._catalog.media_url(self.lesson_id, lesson_fingerprint)
+        if found:
+            _LOGGER.debug("Using cached media url for lesson %s", self.lesson_id)
+            return url
+        url = self._resolve_url()
+        self._catalog.set_media_url(self.lesson_id, lesson_fingerprint, url)
+        return url
+
+    def forget_cached_url(self):
+        """Drop the media url from the catalog, so the next run resolves it again."""
+        if self._catalog is not None:
+            self._catalog.forget_media_url(self.lesson_id)
+
+    def _page_media_url(self, video_url):
+        """
+        HLS url read from the raw lecture page, or None if it needs the browser.
+
+        Only a playlist will do, `EchoVideo.download` hands the url to the HLS
+        downloader; anything else is left to the browser's `<video src>`.
+        """
+        if self._api is None:
+            return None
+        try:
+            urls = self._api.page_media_urls(video_url)
+        except (EchoApiAuthError, requests.RequestException) as e:
+            _LOGGER.debug("Cannot read %s without the browser: %s", video_url, e)
+            return None
+        _LOGGER.debug("Found the following urls in %s: %s", video_url, urls)
+        # the highest numbered one, as for echo360 cloud
+        m3u8_urls = [url for url in urls if url.endswith(".m3u8")]
+        return m3u8_urls[-1] if m3u8_urls else None
+
     def _loop_find_m3u8_url(self, video_url, waitsecond=15, max_attempts=5):
         stale_attempt = 1
         refresh_attempt = 1
-        while True:
-            self._driver.get(video_url)
-            try:
-                # wait for maximum second before timeout
-                WebDriverWait(self._driver, waitsecond).until(
-                    EC.presence_of_element_located((By.ID, "content-player"))
-                )
-                return (
-                    self._driver.find_element_by_id("content-player")
-                    .find_element_by_tag_name("video")
-                    .get_attribute("src")
-                )
-            except TimeoutException:
-                if refresh_attempt >= max_attempts:
-                    print(
-                        "\r\nERROR: Connection timeouted after {} second for {} attempts... \
-                          Possibly internet problem?".format(
-                            waitsecond, max_attempts
-                        )
+        with BROWSER_LOCK:
+            while True:
+                self._driver.get(video_url)
+                try:
+                    # wait for maximum second before timeout
+                    WebDriverWait(self._driver, waitsecond).until(
+                        EC.presence_of_element_located((By.ID, "content-player"))
                     )
-                    raise
-                refresh_attempt += 1
-            except StaleElementReferenceException:
-                if stale_attempt >= max_attempts:
-                    print(
-                        "\r\nERROR: Elements are not stable to retrieve after {} attempts... \
-                        Possibly internet problem?".format(
-                            max_attempts
-                        )
+                    return (
+                        self._driver.find_element(By.ID, "content-player")
+                        .find_element(By.TAG_NAME, "video")
+                        .get_attribute("src")
                     )
-                    raise
-                stale_attempt += 1
+                except TimeoutException:
+                    if refresh_attempt >= max_attempts:
+                        print(
+                            "\r\nERROR: Connection timeouted after {} second for {} attempts... \
+                              Possibly internet problem?".format(
+                                waitsecond, max_attempts
+                            )
+                        )
+                        raise
+                    refresh_attempt += 1
+                except StaleElementReferenceException:
+                    if stale_attempt >= max_attempts:
+                        print(
+                            "\r\nERROR: Elements are not stable to retrieve after {} attempts... \
+                            Possibly internet problem?".format(
+                                max_attempts
+                            )
+                        )
+                        raise
+                    stale_attempt += 1
+
+    @property
+    def lesson_id(self):
+        return self._lesson_id
 
     @property
     def date(self):
@@ -162,6 +308,17 @@ class EchoVideo(object):
 
     @property
     def url(self):
+        # resolved on first use, so lectures that are filtered out never pay for it
+        if not self._resolved:
+            try:
+                self._url = self._cached_url()
+            except Exception:
+                if not self.skip_on_error:
+                    raise
+                _LOGGER.debug("Skipping video %s", self.lesson_id, exc_info=True)
+                self._url = False
+            _LOGGER.debug("Found the following urls %s", self._url)
+            self._resolved = True
         return self._url
 
     @property
@@ -188,12 +345,29 @@ class EchoVideo(object):
         print("Exception: {}".format(str(e)))
         sys.exit(1)
 
-    def download(self, output_dir, filename, pool_size=50):
+    def download(
+        self,
+        output_dir,
+        filename,
+        pool_size=50,
+        mp4_connections=8,
+        feed_mode="hstack",
+        stream_mux=False,
+        postprocessor=None,
+        audio_codec="copy",
+        **downloader_kwargs,
+    ):
+        # echo360 ESS lectures have a single feed that is saved as downloaded, none of
+        # `feed_mode`, `stream_mux`, `postprocessor` or `audio_codec` apply
         try:
             print("")
             print("-" * 60)
             print('Downloading "{}"'.format(filename))
-            self._download_url_to_dir(self.url, output_dir, filename, pool_size)
+            self.output_paths = [
+                self._download_url_to_dir(
+                    self.url, output_dir, filename, pool_size, **downloader_kwargs
+                )
+            ]
             print("-" * 60)
             return True
         except:
@@ -206,30 +380,31 @@ class EchoVideo(object):
         filename: str,
         pool_size: int,
         convert_to_mp4=True,
+        **downloader_kwargs,
     ):
-        echo360_downloader = Downloader(
-            pool_size, selenium_cookies=self._driver.get_cookies()
+        echo360_downloader = Downloader(pool_size, **downloader_kwargs)
+        # write straight to the final name so an interrupted run finds its journal again
+        echo360_downloader.run(
+            url, output_dir, convert_to_mp4=convert_to_mp4, output_name=filename
         )
-        echo360_downloader.run(url, output_dir, convert_to_mp4=convert_to_mp4)
-
-        # rename file
-        ext = echo360_downloader.result_file_name.split(".")[-1]
-        result_full_path = os.path.join(output_dir, "{0}.{1}".format(filename, ext))
-        os.rename(os.path.join(echo360_downloader.result_file_name), result_full_path)
-        return result_full_path
+        return echo360_downloader.result_file_name
 
     def _download_url_to_dir_request(self, session, url, output_dir, filename):
         ext = url.split(".")[-1]
 
         r = session.get(url, stream=True)
         total_size = int(r.headers.get("content-length", 0))
-        block_size = 1024  # 1 kilobyte
         result_full_path = os.path.join(output_dir, filename + ext)
-        with tqdm.tqdm(total=total_size, unit="iB", unit_scale=True) as pbar:
+        task = get_progress_display().task(filename, nbytes=total_size or None)
+        completed = False
+        try:
             with open(result_full_path, "wb") as f:
-                for data in r.iter_content(block_size):
-                    pbar.update(len(data))
-                    f.write(data)
+                stream_to_file(
+                    r, f, on_progress=lambda nbytes: task.update(nbytes=nbytes)
+                )
+            completed = True
+        finally:
+            task.finish(ok=completed)
         return result_full_path
 
     def get_all_parts(self):
@@ -237,22 +412,33 @@ class EchoVideo(object):
 
 
 class EchoCloudVideos(EchoVideos):
-    def __init__(self, videos_json, driver, hostname, skip_video_on_error=True):
+    def __init__(
+        self,
+        videos_json,
+        driver,
+        hostname,
+        skip_video_on_error=True,
+        api=None,
+        catalog=None,
+    ):
         assert videos_json is not None
         self._driver = driver
         self._videos = []
-        total_videos_num = len(videos_json)
-        update_course_retrieval_progress(0, total_videos_num)
+        _LOGGER.debug("Course videos json: %s", videos_json)
 
-        for i, video_json in enumerate(videos_json):
-            print(videos_json)
+        for video_json in videos_json:
             try:
-                self._videos.append(EchoCloudVideo(video_json, self._driver, hostname))
+                video = EchoCloudVideo(
+                    video_json, self._driver, hostname, api=api, catalog=catalog
+                )
             except Exception:
                 if not skip_video_on_error:
                     raise
-            update_course_retrieval_progress(i + 1, total_videos_num)
-
+                _LOGGER.debug("Skipping video %s", video_json, exc_info=True)
+                continue
+            for part in video.get_all_parts():
+                part.skip_on_error = skip_video_on_error
+            self._videos.append(video)
         self._videos.sort(key=operator.attrgetter("date"))
 
     @property
@@ -265,10 +451,14 @@ class EchoCloudVideo(EchoVideo):
     def video_url(self):
         return "{}/lesson/{}/classroom".format(self.hostname, self.video_id)
 
-    def __init__(self, video_json, driver, hostname):
+    def __init__(self, video_json, driver, hostname, api=None, catalog=None):
         self.hostname = hostname
         self._driver = driver
+        self._api = api
+        self._catalog = catalog
         self.video_json = video_json
+        self._resolved = False
+        self._url = None
         self.is_multipart_video = False
         self.sub_videos = [self]
         if "lessons" in video_json:
@@ -279,10 +469,13 @@ class EchoCloudVideo(EchoVideo):
                     driver,
                     hostname,
                     group_name=video_json["groupInfo"]["name"],
+                    api=api,
+                    catalog=catalog,
                 )
                 for sub_video_json in video_json["lessons"]
             ]
             self.is_multipart_video = True
+            self._lesson_id = video_json["groupInfo"].get("id")
             # THIS OBJECT SHOULD NOT BE USED ANYMORE as no further
             # processing will be proceeded.
             self._date = self.get_date(video_json)
@@ -290,83 +483,183 @@ class EchoCloudVideo(EchoVideo):
 
         video_id = "{0}".format(video_json["lesson"]["lesson"]["id"])
         self.video_id = str(video_id)  # cast back to string
-
-        self._driver.get(self.video_url)
-        _LOGGER.debug(
-            "Dumping video page at %s: %s", self.video_url, self._driver.page_source
-        )
-
-        m3u8_url = self._loop_find_m3u8_url(self.video_url, waitsecond=30)
-        _LOGGER.debug("Found the following urls %s", m3u8_url)
-        self._url = m3u8_url
+        self._lesson_id = self.video_id
 
         self._date = self.get_date(video_json)
         self._title = video_json["lesson"]["lesson"]["name"]
 
-    def download(self, output_dir, filename, pool_size=50):
+    def _resolve_url(self):
+        # tries the syllabus json and the lesson media api before the browser
+        return self._loop_find_m3u8_url(self.video_url, waitsecond=30)
+
+    def download(
+        self,
+        output_dir,
+        filename,
+        pool_size=50,
+        mp4_connections=8,
+        feed_mode="hstack",
+        stream_mux=False,
+        postprocessor=None,
+        audio_codec="copy",
+        **downloader_kwargs,
+    ):
+        """
+        Download every feed of the lecture and combine them as `feed_mode` says.
+
+        With a `PostProcessor`, the ffmpeg steps are handed to it once the downloads
+        are done and the greenlet of that job is returned instead of True, so the
+        caller can move on to the next lecture while ffmpeg runs.
+        """
         print("")
         print("-" * 60)
         print('Downloading "{}"'.format(filename))
         if not os.path.exists(output_dir):
             os.makedirs(output_dir)
 
-        session = requests.Session()
-        # load cookies
-        for cookie in self._driver.get_cookies():
-            session.cookies.set(cookie["name"], cookie["value"])
-
         urls = self.url
         if not isinstance(urls, list):
             urls = [urls]
 
-        # Download all of the various tracks
-        final_result = True
-        output_filenames = []
-        for counter, single_url in enumerate(urls):
-            print("- Downloading video feed {}...".format(counter + 1))
-            new_filename = filename + str(counter + 1)
-            output_filenames.append(new_filename)
-            result = self.download_single(
-                session, single_url, output_dir, new_filename, pool_size
+        # the feeds are independent, download them all at once and draw on one pool
+        # of workers
+        if len(urls) > 1:
+            print("- Downloading {} video feeds...".format(len(urls)))
+        output_filenames = [filename + str(counter + 1) for counter in range(len(urls))]
+        pool = Pool(pool_size)
+        # muxing steps of the feeds, when they are left to the post-processor
+        deferred = [] if postprocessor is not None else None
+        jobs = [
+            gevent.spawn(
+                self.download_single,
+                single_url,
+                output_dir,
+                new_filename,
+                pool_size,
+                mp4_connections=mp4_connections,
+                stream_mux=stream_mux,
+                audio_codec=audio_codec,
+                pool=pool,
+                deferred=deferred,
+                **downloader_kwargs,
             )
-            final_result = final_result and result
-
-        if final_result:
+            for single_url, new_filename in zip(urls, output_filenames)
+        ]
+        gevent.joinall(jobs)
+
+        feed_paths = [
+            os.path.join(output_dir, "{}.mp4".format(name)) for name in output_filenames
+        ]
+        failed = [
+            counter
+            for counter, job in enumerate(jobs)
+            if not job.successful() or not job.value
+        ]
+        for counter in failed:
+            job = jobs[counter]
+            reason = job.exception if job.exception is not None else "see above"
+            print("- Video feed {} failed: {}".format(counter + 1, reason))
+
+        def mux_feeds():
+            for step in deferred or []:
+                step()
+
+        if not failed:
             print("All video feeds downloaded successfully!")
-            combine_videos_horizontally(
-                *map(
-                    lambda filename: os.path.join(output_dir, f"{filename}.mp4"),
-                    output_filenames,
-                ),
-                output_path=os.path.join(output_dir, filename + ".mp4"),
-            )
-            for output_filename in output_filenames:
-                os.remove(os.path.join(output_dir, output_filename + ".mp4"))
 
-        return final_result
+            def finish():
+                mux_feeds()
+                self.output_paths = self.combine_feeds(
+                    feed_paths, os.path.join(output_dir, filename), feed_mode
+                )
+                return True
+
+            if postprocessor is None:
+                return finish()
+            return postprocessor.submit(filename, finish)
 
-    def download_single(self, session, single_url, output_dir, filename, pool_size):
+        # keep whatever did arrive, but not combined into a lecture missing a feed
+        if deferred:
+            postprocessor.submit(filename, mux_feeds)
+        for counter, path in enumerate(feed_paths):
+            if counter not in failed:
+                print("- Video feed {} kept as {}".format(counter + 1, path))
+        return False
+
+    @staticmethod
+    def combine_feeds(feed_paths, output_base, feed_mode="hstack"):
+        """
+        Turn the downloaded feeds into the lecture's output, return the output paths.
+
+        `output_base` is the output path without extension. With "separate" the feeds
+        are only renamed and each becomes an output of its own.
+        """
+        if feed_mode not in FEED_MODES:
+            raise ValueError("Unknown feed mode {!r}".format(feed_mode))
+        if len(feed_paths) == 1:
+            # nothing to combine, whatever the mode
+            os.replace(feed_paths[0], output_base + ".mp4")
+            return [output_base + ".mp4"]
+        if feed_mode == "separate":
+            outputs = []
+            for counter, path in enumerate(feed_paths):
+                outputs.append("{} (feed {}).mp4".format(output_base, counter + 1))
+                os.replace(path, outputs[-1])
+            return outputs
+        if feed_mode == "tracks":
+            output_path = output_base + ".mkv"
+            combine_videos_as_tracks(*feed_paths, output_path=output_path)
+        else:
+            output_path = output_base + ".mp4"
+            combine_videos_horizontally(*feed_paths, output_path=output_path)
+        for path in feed_paths:
+            os.remove(path)
+        return [output_path]
+
+    def download_single(
+        self,
+        single_url,
+        output_dir,
+        filename,
+        pool_size,
+        mp4_connections=8,
+        stream_mux=False,
+        audio_codec="copy",
+        deferred=None,
+        **downloader_kwargs,
+    ):
+        """
+        Download one feed to `<filename>.mp4` in `output_dir`.
+
+        `audio_codec` is the audio policy, see `choose_audio_codec`. When a list is
+        given as `deferred`, the ffmpeg step that muxes separately downloaded tracks
+        is appended to it instead of being run.
+        """
+        session = get_session(single_url)
         if single_url.endswith(".m3u8"):
             r = session.get(single_url)
             if not r.ok:
                 print("Error: Failed to get m3u8 info. Skipping this video")
                 return False
 
-            lines = [n for n in r.content.decode().split("\n")]
-            m3u8_video = None
-            m3u8_audio = None
-
-            _LOGGER.debug("Searching for m3u8 with content {}".format(lines))
+            _LOGGER.debug("Searching for m3u8 with content {}".format(r.text))
 
-            m3u8_parser = NaiveM3U8Parser(lines)
             try:
-                m3u8_parser.parse()
-            except Exception as e:
+                playlist = parse_playlist(r.content, base_url=single_url)
+            except ValueError as e:
                 _LOGGER.debug("Exception occurred while parsing m3u8: {}".format(e))
                 print("Failed to parse m3u8. Skipping...")
                 return False
 
-            m3u8_video, m3u8_audio = m3u8_parser.get_video_and_audio()
+            codecs = None
+            if isinstance(playlist, MasterPlaylist):
+                m3u8_video, m3u8_audio = playlist.video_and_audio()
+                variant = playlist.best_variant(video_only=True)
+                codecs = variant.codecs if variant is not None else None
+            else:
+                # already a media playlist, audio is muxed into it
+                m3u8_video, m3u8_audio = single_url, None
+            audio_codec = choose_audio_codec(audio_codec, codecs)
 
             if (
                 m3u8_video is None
@@ -374,57 +667,195 @@ class EchoCloudVideo(EchoVideo):
                 print("ERROR: Failed to find video m3u8... skipping this one")
                 return False
             # NOW we can finally start downloading!
-            from .hls_downloader import urljoin
-
-            audio_file = None
-            if m3u8_audio is not None:
-                print("  > Downloading audio:")
-                audio_file = self._download_url_to_dir(
-                    urljoin(single_url, m3u8_audio),
+            if stream_mux and not stream_mux_supported():
+                print("  > Streaming into ffmpeg needs named pipes, downloading first")
+                stream_mux = False
+            if stream_mux:
+                if not self._download_and_mux(
+                    m3u8_video,
+                    m3u8_audio,
                     output_dir,
-                    filename + "_audio",
+                    filename,
                     pool_size,
-                    convert_to_mp4=False,
+                    audio_codec=audio_codec,
+                    **downloader_kwargs,
+                ):
+                    return False
+            else:
+                tracks = [("video", m3u8_video)]
+                if m3u8_audio is not None:
+                    tracks.append(("audio", m3u8_audio))
+                print("  > Downloading {}:".format(" and ".join(k for k, _ in tracks)))
+                try:
+                    files = self._download_renditions(
+                        tracks, output_dir, filename, pool_size, **downloader_kwargs
+                    )
+                except HlsDownloaderError as e:
+                    print("ERROR: {} Skipping this video".format(e))
+                    return False
+                mux = functools.partial(
+                    self.mux_tracks,
+                    video_file=files[0],
+                    audio_file=files[1] if len(files) > 1 else None,
+                    final_file=os.path.join(output_dir, filename + ".mp4"),
+                    audio_codec=audio_codec,
                 )
-            print("  > Downloading video:")
-            video_file = self._download_url_to_dir(
-                urljoin(single_url, m3u8_video),
-                output_dir,
-                filename + "_video",
-                pool_size,
-                convert_to_mp4=False,
-            )
-            sys.stdout.write("  > Converting to mp4... ")
-            sys.stdout.flush()
-
-            # combine audio file with video (separate audio might not exists.)
-            self.combine_audio_video(
-                audio_file=audio_file,
-                video_file=video_file,
-                final_file=(os.path.join(output_dir, filename + ".mp4")),
-            )
-            if audio_file is not None:
-                os.remove(audio_file)
-            os.remove(video_file)
+                if deferred is not None:
+                    deferred.append(mux)
+                else:
+                    sys.stdout.write("  > Converting to mp4... ")
+                    sys.stdout.flush()
+                    mux()
 
         else:  # ends with mp4
-            import tqdm
-
-            r = session.get(single_url, stream=True)
-            total_size = int(r.headers.get("content-length", 0))
-            block_size = 1024  # 1 kilobyte
-            with tqdm.tqdm(total=total_size, unit="iB", unit_scale=True) as pbar:
-                with open(os.path.join(output_dir, filename + ".mp4"), "wb") as f:
-                    for data in r.iter_content(block_size):
-                        pbar.update(len(data))
-                        f.write(data)
+            try:
+                download_mp4(
+                    session,
+                    single_url,
+                    os.path.join(output_dir, filename + ".mp4"),
+                    resume=downloader_kwargs.get("resume", True),
+                    stats=downloader_kwargs.get("stats"),
+                    connections=mp4_connections,
+                    limiter=downloader_kwargs.get("limiter"),
+                    retry_policy=downloader_kwargs.get("retry_policy"),
+                    chunk_size=downloader_kwargs.get("chunk_size", DEFAULT_CHUNK_SIZE),
+                    metrics=downloader_kwargs.get("metrics"),
+                    progress=downloader_kwargs.get("progress"),
+                )
+            except requests.RequestException as e:
+                print("ERROR: {} Skipping this video".format(e))
+                return False
 
         print("Done!")
         print("-" * 60)
         return True
 
+    def _download_and_mux(
+        self,
+        m3u8_video,
+        m3u8_audio,
+        output_dir,
+        filename,
+        pool_size,
+        audio_codec="copy",
+        **downloader_kwargs,
+    ):
+        """
+        Download the video and audio playlists at the same time, straight into ffmpeg.
+
+        ffmpeg reads both tracks in step, so they have to download concurrently; the
+        segments never touch the disk, hence there is no journal to resume from.
+        """
+        tracks = [("video", m3u8_video)]
+        if m3u8_audio is not None:
+            tracks.append(("audio", m3u8_audio))
+        final_file = os.path.join(output_dir, filename + ".mp4")
+        muxer = StreamMuxer(
+            final_file, len(tracks), self.audio_video_options(audio_codec)
+        )
+        print("  > Downloading and converting {} track(s):".format(len(tracks)))
+        try:
+            self._download_renditions(
+                tracks,
+                output_dir,
+                filename,
+                pool_size,
+                sinks=muxer.writers,
+                # stopping ffmpeg also fails the other track at its next write
+                on_error=muxer.abort,
+                **dict(downloader_kwargs, resume=False),
+            )
+        except (HlsDownloaderError, OSError) as e:
+            muxer.abort()
+            print("ERROR: {} Skipping this video".format(e))
+            return False
+        try:
+            muxer.wait()
+        except ffmpy.FFRuntimeError as e:
+            muxer.abort()
+            print("ERROR: {} Skipping this video".format(e))
+            return False
+        return True
+
+    def _download_renditions(
+        self,
+        tracks,
+        output_dir,
+        filename,
+        pool_size,
+        sinks=None,
+        on_error=None,
+        pool=None,
+        **downloader_kwargs,
+    ):
+        """
+        Download several `(kind, url)` playlists at the same time.
+
+        The renditions share one pool of `pool_size` workers, so a small audio
+        playlist fills the gaps left by the video one instead of waiting for it.
+        Returns the downloaded files in the order of `tracks`.
+
+        Args:
+            sinks: optional writable object per track, see `Downloader.run`
+            on_error: called as soon as one track fails, before the others finish
+            pool: a `Pool` to share with other downloads instead of a new one
+
+        Raises:
+            HlsDownloaderError: or whatever else made the first track fail
+        """
+        if pool is None:
+            pool = Pool(pool_size)
+        failures = []
+
+        def download_track(track, sink):
+            kind, url = track
+            downloader = Downloader(pool_size, pool=pool, **downloader_kwargs)
+            try:
+                downloader.run(
+                    url,
+                    output_dir,
+                    convert_to_mp4=False,
+                    output_name=filename + "_" + kind,
+                    sink=sink,
+                )
+            except Exception as e:
+                failures.append(e)
+                if on_error is not None:
+                    on_error()
+                return None
+            return downloader.result_file_name
+
+        jobs = [
+            gevent.spawn(download_track, track, sink)
+            for track, sink in zip(tracks, sinks or [None] * len(tracks))
+        ]
+        gevent.joinall(jobs)
+        if failures:
+            raise failures[0]
+        return [job.value for job in jobs]
+
+    @staticmethod
+    def audio_video_options(audio_codec="copy"):
+        """ffmpeg output options for muxing a video track and its audio into mp4."""
+        # -c:a is harmless when there turns out to be no audio at all
+        return ["-c:v", "copy", "-c:a", audio_codec]
+
     @staticmethod
-    def combine_audio_video(audio_file, video_file, final_file):
+    def mux_tracks(video_file, audio_file, final_file, audio_codec="copy"):
+        """Mux the downloaded tracks into `final_file` and remove them."""
+        # combine audio file with video (separate audio might not exists.)
+        EchoCloudVideo.combine_audio_video(
+            audio_file=audio_file,
+            video_file=video_file,
+            final_file=final_file,
+            audio_codec=audio_codec,
+        )
+        if audio_file is not None:
+            os.remove(audio_file)
+        os.remove(video_file)
+
+    @staticmethod
+    def combine_audio_video(audio_file, video_file, final_file, audio_codec="copy"):
         if os.path.exists(final_file):
             os.remove(final_file)
         _inputs = {}
@@ -433,49 +864,60 @@ class EchoCloudVideo(EchoVideo):
             _inputs[audio_file] = None
 
         ff = ffmpy.FFmpeg(
-            # global_options="-loglevel panic",
+            global_options=["-y", "-loglevel", "error"],
             inputs=_inputs,
-            outputs={final_file: ["-c:v", "copy", "-c:a", "ac3"]},
+            outputs={final_file: EchoCloudVideo.audio_video_options(audio_codec)},
         )
-        ff.run()
+        try:
+            run_ffmpeg(ff)
+        except ffmpy.FFRuntimeError:
+            if audio_codec != "copy":
+                raise
+            # the playlist did not say what the audio is and mp4 would not take it
+            _LOGGER.debug("Stream copy failed for %s", final_file, exc_info=True)
+            print("  > Audio cannot be copied into mp4, transcoding it")
+            EchoCloudVideo.combine_audio_video(
+                audio_file, video_file, final_file, FALLBACK_AUDIO_CODEC
+            )
 
     def _loop_find_m3u8_url(self, video_url, waitsecond=15, max_attempts=5):
         def brute_force_get_url(suffix):
             # this is the first method I tried, which sort of works
             stale_attempt = 1
             refresh_attempt = 1
-            while True:
-                self._driver.get(video_url)
-                try:
-                    # the replace is for reversing the escape by the escapped js in the page source
-                    urls = set(
-                        re.findall(
-                            'https://[^,"]*?[.]{}'.format(suffix),
-                            self._driver.page_source.replace("\/", "/"),
-                        )
-                    )
-                    return urls
-
-                except selenium.common.exceptions.TimeoutException:
-                    if refresh_attempt >= max_attempts:
-                        print(
-                            "\r\nERROR: Connection timeouted after {} second for {} attempts... \
-                              Possibly internet problem?".format(
-                                waitsecond, max_attempts
+            with BROWSER_LOCK:
+                while True:
+                    self._driver.get(video_url)
+                    try:
+                        # the replace is for reversing the escape by the escapped js in the page source
+                        urls = set(
+                            re.findall(
+                                'https://[^,"]*?[.]{}'.format(suffix),
+                                self._driver.page_source.replace("\/", "/"),
                             )
                         )
-                        raise
-                    refresh_attempt += 1
-                except StaleElementReferenceException:
-                    if stale_attempt >= max_attempts:
-                        print(
-                            "\r\nERROR: Elements are not stable to retrieve after {} attempts... \
-                            Possibly internet problem?".format(
-                                max_attempts
+                        return urls
+
+                    except selenium.common.exceptions.TimeoutException:
+                        if refresh_attempt >= max_attempts:
+                            print(
+                                "\r\nERROR: Connection timeouted after {} second for {} attempts... \
+                                  Possibly internet problem?".format(
+                                    waitsecond, max_attempts
+                                )
                             )
-                        )
-                        raise
-                    stale_attempt += 1
+                            raise
+                        refresh_attempt += 1
+                    except StaleElementReferenceException:
+                        if stale_attempt >= max_attempts:
+                            print(
+                                "\r\nERROR: Elements are not stable to retrieve after {} attempts... \
+                                Possibly internet problem?".format(
+                                    max_attempts
+                                )
+                            )
+                            raise
+                        stale_attempt += 1
 
         def brute_force_get_mp4_url():
             """Forcefully try to find all .mp4 url in the page source"""
@@ -523,8 +965,45 @@ class EchoCloudVideo(EchoVideo):
             # usually hd is the last one. so we will sort in reverse order
             return next(reversed(urls))
 
+        def from_lesson_media():
+            # the json the player itself loads, fetched without the browser
+            if self._api is None:
+                raise ValueError("No API client")
+            media = self._api.lesson_media(self.video_id)
+            urls = find_media_urls(media, "mp4")
+            if urls:
+                # same preference as brute_force_get_mp4_url
+                return urls[:2]
+            urls = find_media_urls(media, "m3u8")
+            if not any(url.endswith("av.m3u8") for url in urls):
+                raise ValueError("Cannot find media urls in lesson media")
+            return select_av_m3u8(urls)
+
+        def select_av_m3u8(m3u8urls):
+            # find one that has audio + video
+            m3u8urls = [url for url in m3u8urls if url.endswith("av.m3u8")]
+            if len(m3u8urls) == 0:
+                print(
+                    "No audio+video m3u8 files found! Skipping...\n"
+                    "This can either be (i) Credential failure? (ii) Logic error "
+                    "in the script. (iii) This lecture only provides audio?\n"
+                    "This script is hard-coded to download audio+video. "
+                    "If this is your intended behaviour, "
+                    "please contact the author."
+                )
+                return False
+            # There could exists multiple m3u8 files
+            # (e.g. .../s1_av.m3u8, .../s2_av.m3u8, etc.) Probably to refer to
+            # different quality?? We will set it to always prefer higher number.
+            # Since (from my experiment) the prefixes are always the same, we will
+            # just use text sorting to get the higher number.
+            # Some university have two different video feeds, use flag `-a` to
+            # download both feeds.
+            m3u8urls = list(reversed(m3u8urls))
+            return m3u8urls[:2]
+
         # try different methods in series, first the preferred ones, then the more
-        # obscure ones.
+        # obscure ones. Only the brute force methods need the browser.
         try:
             _LOGGER.debug("Trying from_json_mp4 method")
             return from_json_mp4()
@@ -533,6 +1012,13 @@ class EchoCloudVideo(EchoVideo):
         try:
             _LOGGER.debug("Trying from_json_m3u8 method")
             m3u8urls = from_json_m3u8()
+            if m3u8urls and any(url.endswith("av.m3u8") for url in m3u8urls):
+                return select_av_m3u8(m3u8urls)
+        except Exception as e:
+            _LOGGER.debug("Encountered exception: {}".format(e))
+        try:
+            _LOGGER.debug("Trying from_lesson_media method")
+            return from_lesson_media()
         except Exception as e:
             _LOGGER.debug("Encountered exception: {}".format(e))
         try:
@@ -549,27 +1035,7 @@ class EchoCloudVideo(EchoVideo):
             print("Tried all methods to retrieve videos but all had failed!")
             raise AllMethodsExhaustedError()
 
-        # find one that has audio + video
-        m3u8urls = [url for url in m3u8urls if url.endswith("av.m3u8")]
-        if len(m3u8urls) == 0:
-            print(
-                "No audio+video m3u8 files found! Skipping...\n"
-                "This can either be (i) Credential failure? (ii) Logic error "
-                "in the script. (iii) This lecture only provides audio?\n"
-                "This script is hard-coded to download audio+video. "
-                "If this is your intended behaviour, "
-                "please contact the author."
-            )
-            return False
-        # There could exists multiple m3u8 files
-        # (e.g. .../s1_av.m3u8, .../s2_av.m3u8, etc.) Probably to refer to
-        # different quality?? We will set it to always prefer higher number.
-        # Since (from my experiment) the prefixes are always the same, we will
-        # just use text sorting to get the higher number.
-        # Some university have two different video feeds, use flag `-a` to
-        # download both feeds.
-        m3u8urls = list(reversed(m3u8urls))
-        return m3u8urls[:2]
+        return select_av_m3u8(m3u8urls)
 
     def _extract_date(self, video_json):
         if self.is_multipart_video:
@@ -591,11 +1057,11 @@ class EchoCloudVideo(EchoVideo):
 class EchoCloudSubVideo(EchoCloudVideo):
     """Some video in echo360 cloud is multi-part and this represents it."""
 
-    def __init__(self, video_json, driver, hostname, group_name):
+    def __init__(
+        self, video_json, driver, hostname, group_name, api=None, catalog=None
+    ):
         super(EchoCloudSubVideo, self).__init__(
-            video_json,
-            driver,
-            hostname,
+            video_json, driver, hostname, api=api, catalog=catalog
         )
         self.group_name = group_name
 